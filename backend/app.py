@@ -3,15 +3,24 @@ from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 import os
 import sys
+import json
 from datetime import timedelta
 from pathlib import Path
 from models import db, init_db
+from sqlalchemy import event
 from routes.device_routes import device_bp
 from routes.user_routes import user_bp
 from routes.breach_routes import breach_bp
 from routes.automation_routes import automation_bp
 from routes.wipe_routes import wipe_bp
 from utils.scheduler import init_scheduler
+from utils.activity_log import init_activity_log_worker
+import logging
+
+# Skip collecting unused per-record logging fields (thread/process info)
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
 
 # Create Flask app instance
 app = Flask(__name__)
@@ -28,6 +37,27 @@ app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-pro
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'jwt-secret-key-change-in-production')
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
 
+# JSON responses: skip key sorting and always emit compact output (no
+# debug-mode pretty printing) - device payloads with hardware info are large
+# and agents poll frequently. When orjson is available, serialize with it
+# instead of the stdlib encoder (orjson is compact/unsorted by default and
+# handles datetimes natively).
+try:
+    import orjson
+    from flask.json.provider import DefaultJSONProvider
+
+    class OrjsonProvider(DefaultJSONProvider):
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj, default=self.default).decode()
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+    app.json = OrjsonProvider(app)
+except ImportError:
+    app.json.sort_keys = False
+    app.json.compact = True
+
 # Fix database path - use absolute path
 db_url = os.getenv('DATABASE_URL')
 
@@ -76,6 +106,13 @@ else:
 
 app.config['SQLALCHEMY_DATABASE_URI'] = db_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Recycle dead pooled connections before handing them to a request; size the
+# pool for a fleet of concurrently polling agents on server databases
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_pre_ping': True, 'query_cache_size': 1200}
+if db_url and not db_url.startswith('sqlite'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'].update(
+        {'pool_size': 20, 'max_overflow': 40, 'pool_recycle': 1800, 'pool_timeout': 10}
+    )
 
 # Initialize extensions
 CORS(app)
@@ -85,20 +122,52 @@ db.init_app(app)
 # Initialize database (with error handling for serverless)
 try:
     with app.app_context():
-        init_db()
-        # Enable WAL mode for better concurrency (only for SQLite, skip on serverless)
+        # Tune SQLite for the write-heavy agent endpoints on every pooled
+        # connection: WAL lets readers run alongside the writer and
+        # synchronous=NORMAL halves the fsyncs per commit
         if db_url and db_url.startswith('sqlite'):
             try:
-                engine = db.get_engine()
-                with engine.connect() as conn:
-                    conn.execute(db.text("PRAGMA journal_mode=WAL"))
-                    conn.commit()
-                print("[OK] SQLite WAL mode enabled for better concurrency")
+                @event.listens_for(db.engine, 'connect')
+                def _set_sqlite_pragmas(dbapi_conn, _record):
+                    cur = dbapi_conn.cursor()
+                    cur.execute("PRAGMA journal_mode=WAL")
+                    cur.execute("PRAGMA synchronous=NORMAL")
+                    cur.execute("PRAGMA temp_store=MEMORY")
+                    cur.close()
+                print("[OK] SQLite pragmas registered (WAL, synchronous=NORMAL, temp_store=MEMORY)")
             except Exception as e:
-                print(f"[WARN] Could not enable WAL mode: {e}")
+                print(f"[WARN] Could not register SQLite pragmas: {e}")
+        init_db()
 except Exception as e:
     print(f"[WARN] Database initialization error (may be expected on serverless): {e}")
 
+# WSGI-level short circuit for the trivial client-info endpoint: it only
+# reflects the caller's IP, so it skips Flask routing, the JWT setup and
+# jsonify entirely. The blueprint route stays as a fallback for anything
+# not hitting this exact path.
+class _ClientInfoMiddleware:
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO') == '/api/client_info' and environ.get('REQUEST_METHOD') == 'GET':
+            forwarded = environ.get('HTTP_X_FORWARDED_FOR', '')
+            if forwarded:
+                ip = forwarded.partition(',')[0].strip()
+            else:
+                ip = environ.get('REMOTE_ADDR', '')
+            body = json.dumps({'ip': ip}).encode()
+            start_response('200 OK', [
+                ('Content-Type', 'application/json'),
+                ('Content-Length', str(len(body))),
+                # Flask-CORS never sees this response, so emit the header here
+                ('Access-Control-Allow-Origin', '*'),
+            ])
+            return [body]
+        return self.wsgi_app(environ, start_response)
+
+app.wsgi_app = _ClientInfoMiddleware(app.wsgi_app)
+
 # Register blueprints
 app.register_blueprint(user_bp, url_prefix='/api')
 app.register_blueprint(device_bp, url_prefix='/api')
@@ -114,6 +183,10 @@ if not is_serverless:
         init_scheduler(app)
     except Exception as e:
         print(f"[WARN] Scheduler initialization failed (may be expected): {e}")
+    try:
+        init_activity_log_worker(app)
+    except Exception as e:
+        print(f"[WARN] Activity-log worker initialization failed: {e}")
 else:
     print("[INFO] Skipping scheduler initialization (serverless environment)")
 
@@ -162,5 +235,7 @@ application = app
 if __name__ == '__main__':
     # Disable reloader on Windows to avoid database path issues
     use_reloader = sys.platform != 'win32'
-    app.run(debug=True, host='0.0.0.0', port=5000, use_reloader=use_reloader)
+    # threaded=True lets the dev server overlap requests during DB waits
+    # instead of serializing every agent poll behind one handler
+    app.run(debug=True, host='0.0.0.0', port=5000, use_reloader=use_reloader, threaded=True)
 
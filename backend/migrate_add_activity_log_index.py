@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the activity_logs (device_id, created_at DESC) index
+"""
+
+import sqlite3
+import sys
+import io
+from pathlib import Path
+
+# Fix Windows console encoding
+sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+
+def migrate_database():
+    """Add composite index used by the activity-log listing query"""
+
+    # Get database path
+    backend_dir = Path(__file__).parent
+    project_dir = backend_dir.parent
+    database_dir = project_dir / 'database'
+    db_path = database_dir / 'antitheft.db'
+
+    if not db_path.exists():
+        print("Database file not found. It will be created automatically when you restart the backend.")
+        return
+
+    print(f"Migrating database: {db_path}")
+
+    try:
+        conn = sqlite3.connect(str(db_path))
+        cursor = conn.cursor()
+
+        print("Adding activity_logs (device_id, created_at DESC) index...")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS ix_activity_logs_device_id_created_at "
+            "ON activity_logs(device_id, created_at DESC)"
+        )
+        print("✓ Added ix_activity_logs_device_id_created_at index")
+
+        conn.commit()
+        conn.close()
+
+        print("\n✅ Database migration completed successfully!")
+
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        raise
+
+if __name__ == '__main__':
+    migrate_database()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the hashed token column to device_link_tokens
+"""
+
+import hashlib
+import sqlite3
+import sys
+import io
+from pathlib import Path
+
+# Fix Windows console encoding
+sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+
+def migrate_database():
+    """Add token_hash column, backfill it, and index it"""
+
+    # Get database path
+    backend_dir = Path(__file__).parent
+    project_dir = backend_dir.parent
+    database_dir = project_dir / 'database'
+    db_path = database_dir / 'antitheft.db'
+
+    if not db_path.exists():
+        print("Database file not found. It will be created automatically when you restart the backend.")
+        return
+
+    print(f"Migrating database: {db_path}")
+
+    try:
+        conn = sqlite3.connect(str(db_path))
+        cursor = conn.cursor()
+
+        # Check existing columns
+        cursor.execute("PRAGMA table_info(device_link_tokens)")
+        columns = [col[1] for col in cursor.fetchall()]
+
+        if 'token_hash' not in columns:
+            print("Adding token_hash column...")
+            cursor.execute("ALTER TABLE device_link_tokens ADD COLUMN token_hash VARCHAR(64)")
+            print("✓ Added token_hash column")
+        else:
+            print("- token_hash column already exists")
+
+        print("Backfilling hashes for existing tokens...")
+        cursor.execute("SELECT id, token FROM device_link_tokens WHERE token_hash IS NULL")
+        rows = cursor.fetchall()
+        for row_id, token in rows:
+            token_hash = hashlib.sha256(token.encode()).hexdigest()
+            cursor.execute(
+                "UPDATE device_link_tokens SET token_hash = ? WHERE id = ?",
+                (token_hash, row_id)
+            )
+        print(f"✓ Backfilled {len(rows)} token hash(es)")
+
+        print("Adding token_hash index...")
+        cursor.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS ix_device_link_tokens_token_hash "
+            "ON device_link_tokens(token_hash)"
+        )
+        print("✓ Added ix_device_link_tokens_token_hash index")
+
+        conn.commit()
+        conn.close()
+
+        print("\n✅ Database migration completed successfully!")
+
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        raise
+
+if __name__ == '__main__':
+    migrate_database()
@@ -1,10 +1,22 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.orm import validates
+from operator import attrgetter
+import hashlib
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
-import json
 
 db = SQLAlchemy()
 
+def _format_utc_datetime(dt):
+    """Format a naive UTC datetime with an explicit 'Z' suffix"""
+    if dt is None:
+        return None
+    iso_str = dt.isoformat()
+    if not iso_str.endswith('Z') and '+' not in iso_str and '-' not in iso_str[-6:]:
+        return iso_str + 'Z'
+    return iso_str
+
 class User(db.Model):
     __tablename__ = 'users'
     
@@ -20,8 +32,16 @@ class User(db.Model):
     
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
-    
+
+    def set_unusable_password(self):
+        """Mark the account as password-less (OAuth-only sign-in)"""
+        self.password_hash = '!'
+
     def check_password(self, password):
+        # Sentinel for OAuth-only accounts - never matches, and skips the
+        # KDF entirely
+        if self.password_hash.startswith('!'):
+            return False
         return check_password_hash(self.password_hash, password)
     
     def to_dict(self):
@@ -35,7 +55,11 @@ class User(db.Model):
 
 class Device(db.Model):
     __tablename__ = 'devices'
-    
+
+    # Composite index for the ownership predicate used by trigger_action,
+    # update_device, delete_device, mark_as_missing and set_geofence
+    __table_args__ = (db.Index('ix_devices_user_devid', 'user_id', 'device_id'),)
+
     id = db.Column(db.Integer, primary_key=True)
     device_id = db.Column(db.String(100), unique=True, nullable=False, index=True)
     fingerprint_hash = db.Column(db.String(64), unique=True, nullable=True, index=True)  # SHA-256 hash for device identification
@@ -67,7 +91,10 @@ class Device(db.Model):
     last_lat = db.Column(db.Float)
     last_lng = db.Column(db.Float)
     last_location_update = db.Column(db.DateTime)
-    last_seen = db.Column(db.DateTime, default=datetime.utcnow)
+    # server_default lets the DB fill the timestamp on INSERT so the ORM does
+    # not have to ship it. No onupdate: only agent traffic may bump
+    # last_seen, so the agent-facing handlers assign it explicitly.
+    last_seen = db.Column(db.DateTime, default=datetime.utcnow, server_default=db.func.now())
     is_primary = db.Column(db.Boolean, default=False)    # Primary device for the user (e.g. first browser)
     is_missing = db.Column(db.Boolean, default=False)
     missing_since = db.Column(db.DateTime)
@@ -82,7 +109,7 @@ class Device(db.Model):
     was_inside_geofence = db.Column(db.Boolean, default=True)  # Track previous state
     current_wifi_ssid = db.Column(db.String(100))  # Current WiFi SSID (reported by device)
     connection_key = db.Column(db.String(64), unique=True, index=True)  # Key for device to connect (deprecated - agent-first)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, server_default=db.func.now())
     registered_at = db.Column(db.DateTime)  # When device was first registered (agent-first registration time)
     
     # Prey Project-style Hardware Information (from native agent)
@@ -98,84 +125,71 @@ class Device(db.Model):
     cpu_speed_mhz = db.Column(db.Integer)  # CPU speed in MHz
     ram_mb = db.Column(db.Integer)  # Total RAM in MB
     ram_gb = db.Column(db.Float)  # Total RAM in GB (calculated)
-    network_interfaces = db.Column(db.Text)  # JSON array of network interfaces
-    mac_addresses = db.Column(db.Text)  # JSON array of MAC addresses
+    network_interfaces = db.Column(db.JSON)  # Array of network interfaces
+    mac_addresses = db.Column(db.JSON)  # Array of MAC addresses
     
     activity_logs = db.relationship('ActivityLog', backref='device', lazy=True)
-    
+
+    # Cached to_dict() payload. Devices are read far more often than they are
+    # written (agents poll status/config constantly), so the serialized dict is
+    # built once per instance and reused until SQLAlchemy loads, refreshes or
+    # expires it - expire fires on every commit that touched the row.
+    _dict_cache = None
+
     def to_dict(self):
-        # Helper to format datetime with UTC timezone indicator
-        def format_utc_datetime(dt):
-            if dt is None:
-                return None
-            # Ensure UTC timezone is indicated with 'Z' suffix
-            iso_str = dt.isoformat()
-            if not iso_str.endswith('Z') and '+' not in iso_str and '-' not in iso_str[-6:]:
-                # Add 'Z' to indicate UTC if timezone not present
-                return iso_str + 'Z'
-            return iso_str
-        
-        return {
-            'id': self.id,
-            'device_id': self.device_id,
-            'name': self.name,
-            'device_type': self.device_type,
-            'os_name': self.os_name,
-            'os_version': self.os_version,
-            'architecture': self.architecture,
-            'device_class': self.device_class,
-            'gpu': self.gpu,
-            'browser': self.browser,
-            'browser_name': self.browser_name,
-            'browser_version': self.browser_version,
-            'platform': self.platform,
-            'user_agent': self.user_agent,
-            'screen_resolution': self.screen_resolution,
-            'timezone': self.timezone,
-            'last_ip': self.last_ip,
-            'os': self.os,  # Legacy field for backward compatibility
-            'user_id': self.user_id,
-            'status': self.status,
-            'last_lat': self.last_lat,
-            'last_lng': self.last_lng,
-            'last_location_update': format_utc_datetime(self.last_location_update),
-            'last_seen': format_utc_datetime(self.last_seen),
-            'is_missing': self.is_missing,
-            'missing_since': format_utc_datetime(self.missing_since),
-            'geofence_center_lat': self.geofence_center_lat,
-            'geofence_center_lng': self.geofence_center_lng,
-            'geofence_radius_m': self.geofence_radius_m,
-            'geofence_enabled': self.geofence_enabled,
-            'geofence_type': self.geofence_type,
-            'geofence_wifi_ssid': self.geofence_wifi_ssid,
-            'was_inside_geofence': self.was_inside_geofence,
-            'current_wifi_ssid': self.current_wifi_ssid,  # Current WiFi SSID from device
-            'connection_key': self.connection_key if self.connection_key else None,
-            'battery_percentage': self.battery_percentage,  # Battery percentage (0-100)
-            'created_at': format_utc_datetime(self.created_at),
-            'registered_at': format_utc_datetime(self.registered_at),
-            'is_primary': self.is_primary,
-            'fingerprint_hash': self.fingerprint_hash,  # For device identification
-            # Hardware information (Prey Project style)
-            'serial_number': self.serial_number,
-            'bios_vendor': self.bios_vendor,
-            'bios_version': self.bios_version,
-            'motherboard_vendor': self.motherboard_vendor,
-            'motherboard_model': self.motherboard_model,
-            'motherboard_serial': self.motherboard_serial,
-            'cpu_model': self.cpu_model,
-            'cpu_cores': self.cpu_cores,
-            'cpu_threads': self.cpu_threads,
-            'cpu_speed_mhz': self.cpu_speed_mhz,
-            'ram_mb': self.ram_mb,
-            'ram_gb': self.ram_gb,
-            'network_interfaces': json.loads(self.network_interfaces) if self.network_interfaces else None,
-            'mac_addresses': json.loads(self.mac_addresses) if self.mac_addresses else None
-        }
+        if self._dict_cache is None:
+            self._dict_cache = self._build_dict()
+        return self._dict_cache
+
+    # Serialized field order, fixed at class definition so _build_dict can
+    # pull every attribute in one C-level attrgetter call instead of ~50
+    # getattr lookups per device
+    _FIELDS = (
+        'id', 'device_id', 'name', 'device_type', 'os_name', 'os_version',
+        'architecture', 'device_class', 'gpu', 'browser', 'browser_name',
+        'browser_version', 'platform', 'user_agent', 'screen_resolution',
+        'timezone', 'last_ip', 'os', 'user_id', 'status', 'last_lat',
+        'last_lng', 'last_location_update', 'last_seen', 'is_missing',
+        'missing_since', 'geofence_center_lat', 'geofence_center_lng',
+        'geofence_radius_m', 'geofence_enabled', 'geofence_type',
+        'geofence_wifi_ssid', 'was_inside_geofence', 'current_wifi_ssid',
+        'connection_key', 'battery_percentage', 'created_at',
+        'registered_at', 'is_primary', 'fingerprint_hash', 'serial_number',
+        'bios_vendor', 'bios_version', 'motherboard_vendor',
+        'motherboard_model', 'motherboard_serial', 'cpu_model', 'cpu_cores',
+        'cpu_threads', 'cpu_speed_mhz', 'ram_mb', 'ram_gb',
+        'network_interfaces', 'mac_addresses'
+    )
+    _DT_FIELDS = ('last_location_update', 'last_seen', 'missing_since',
+                  'created_at', 'registered_at')
+    _field_getter = attrgetter(*_FIELDS)
+
+    def _build_dict(self):
+        d = dict(zip(self._FIELDS, self._field_getter(self)))
+        for key in self._DT_FIELDS:
+            d[key] = _format_utc_datetime(d[key])
+        # Empty connection keys serialize as null, as before
+        d['connection_key'] = d['connection_key'] or None
+        return d
+
+@event.listens_for(Device, 'load')
+@event.listens_for(Device, 'refresh')
+@event.listens_for(Device, 'expire')
+def _invalidate_device_dict_cache(target, *args):
+    """Drop the cached to_dict() payload whenever instance state changes"""
+    target._dict_cache = None
 
 class ActivityLog(db.Model):
     __tablename__ = 'activity_logs'
-    
+
+    # Composite index matches the hot "logs for device, newest first" query
+    # so it walks the index backwards instead of sorting; it also covers
+    # plain device_id lookups as a prefix
+    __table_args__ = (
+        db.Index('ix_activity_logs_device_id_created_at',
+                 'device_id', db.text('created_at DESC')),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     device_id = db.Column(db.Integer, db.ForeignKey('devices.id'), nullable=False)
     action = db.Column(db.String(50), nullable=False)  # location_update, lock, alarm, wipe, screenshot
@@ -183,28 +197,16 @@ class ActivityLog(db.Model):
     lat = db.Column(db.Float)
     lng = db.Column(db.Float)
     screenshot_path = db.Column(db.String(255))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, server_default=db.func.now())
     
+    _FIELDS = ('id', 'device_id', 'action', 'description', 'lat', 'lng',
+               'screenshot_path', 'created_at')
+    _field_getter = attrgetter(*_FIELDS)
+
     def to_dict(self):
-        # Format UTC datetime with 'Z' suffix
-        def format_utc_datetime(dt):
-            if dt is None:
-                return None
-            iso_str = dt.isoformat()
-            if not iso_str.endswith('Z') and '+' not in iso_str and '-' not in iso_str[-6:]:
-                return iso_str + 'Z'
-            return iso_str
-        
-        return {
-            'id': self.id,
-            'device_id': self.device_id,
-            'action': self.action,
-            'description': self.description,
-            'lat': self.lat,
-            'lng': self.lng,
-            'screenshot_path': self.screenshot_path,
-            'created_at': format_utc_datetime(self.created_at)
-        }
+        d = dict(zip(self._FIELDS, self._field_getter(self)))
+        d['created_at'] = _format_utc_datetime(d['created_at'])
+        return d
 
 class BreachReport(db.Model):
     __tablename__ = 'breach_reports'
@@ -339,14 +341,35 @@ class DeviceLinkToken(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     token = db.Column(db.String(64), unique=True, nullable=False, index=True)
+    # SHA-256 of the token, kept in lockstep via the validator below; agent
+    # registration looks tokens up by this fixed-length hashed key. The raw
+    # token column stays because the pending-link poll hands it to the agent.
+    token_hash = db.Column(db.String(64), unique=True, index=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     expires_at = db.Column(db.DateTime, nullable=False)
     used = db.Column(db.Boolean, default=False)
     used_at = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # Covering index for the agent polling query in get_pending_link_token
+    # (user_id + used + expires_at filter, newest-first) so each poll is an
+    # index walk instead of a scan+sort.
+    __table_args__ = (
+        db.Index('ix_device_link_tokens_poll', 'user_id', 'used', 'expires_at', 'created_at'),
+    )
+
     user = db.relationship('User', backref='device_link_tokens')
 
+    @staticmethod
+    def hash_token(raw):
+        """Hash a presented token value for lookup against token_hash"""
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    @validates('token')
+    def _sync_token_hash(self, key, value):
+        self.token_hash = self.hash_token(value) if value else None
+        return value
+
 def init_db():
     """Initialize database tables"""
     try:
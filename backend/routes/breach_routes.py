@@ -45,7 +45,7 @@ def check_breach_email(email):
 def detect_breach():
     try:
         user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        user = db.session.get(User, user_id)
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
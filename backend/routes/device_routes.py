@@ -1,15 +1,183 @@
 from flask import Blueprint, request, jsonify
+from werkzeug.exceptions import HTTPException
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import db, Device, ActivityLog, User, DeviceLinkToken
+from sqlalchemy import update, select
+from sqlalchemy.orm import load_only, joinedload
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from datetime import datetime, timedelta
+from functools import wraps
 from utils.geofence import check_geofence
+from utils.db_session import no_expire_on_commit
+from utils.activity_log import log_activity
+import base64
 import secrets
 import math
 import logging
 import json
+import platform
+import time
 
 device_bp = Blueprint('device', __name__)
 
+@device_bp.app_errorhandler(Exception)
+def _handle_unexpected_error(e):
+    """
+    Central 500 handler so view bodies can drop their broad try/except
+    wrappers: the session is rolled back once here and the traceback is
+    preserved in the log instead of being swallowed per handler.
+    """
+    if isinstance(e, HTTPException):
+        return e
+    db.session.rollback()
+    logging.exception("Unhandled error: %s", e)
+    return jsonify({'error': str(e)}), 500
+
+# Server hostname fallback for generated device IDs - platform.node() does a
+# uname() syscall, so resolve it once at import instead of per request
+_HOSTNAME = platform.node() or 'device'
+
+def _json_body():
+    """
+    Parse the request body as JSON directly from the raw bytes.
+    Skips get_json()'s intermediate string decode and keeps Werkzeug from
+    caching a second copy of the body (cache=False) - agent hardware
+    payloads can be large. Returns {} for empty or malformed bodies.
+    """
+    raw = request.get_data(cache=False)
+    if not raw:
+        return {}
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return {}
+
+def require_json_body(max_bytes=64 * 1024):
+    """
+    Reject oversize or non-JSON bodies before they are read into memory.
+    Declared Content-Length and mimetype are checked up front, so noise or
+    attack traffic is turned away without materializing the payload.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if request.content_length:
+                if request.content_length > max_bytes:
+                    return jsonify({'error': 'Payload too large'}), 413
+                if request.mimetype != 'application/json':
+                    return jsonify({'error': 'Content-Type must be application/json'}), 415
+            return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# Default-owner lookup for auto-registered devices, cached briefly - the
+# admin/first-user answer almost never changes and this sits on a hot path
+_DEFAULT_OWNER_TTL = 60  # seconds
+_default_owner_cache = [0.0, None]  # [expires_at, user_id]
+
+def _default_owner_id():
+    """
+    Return the user_id that auto-registered devices should attach to
+    (admin account if present, otherwise the first user), or None if no
+    users exist. Cached for a minute to keep two SELECTs off the
+    update_location hot path.
+    """
+    now = time.monotonic()
+    if _default_owner_cache[1] is not None and now < _default_owner_cache[0]:
+        return _default_owner_cache[1]
+    owner = User.query.filter_by(email='admin@antitheft.com').first() or User.query.first()
+    if not owner:
+        return None
+    _default_owner_cache[0] = now + _DEFAULT_OWNER_TTL
+    _default_owner_cache[1] = owner.id
+    return owner.id
+
+# Verdicts from _classify_location()
+_LOC_ACCEPT = 'accept'
+_LOC_REJECT_KL = 'reject_kl'            # fresh device reporting the KL ISP location
+_LOC_REJECT_KL_JUMP = 'reject_kl_jump'  # device jumped from elsewhere into KL
+_LOC_REJECT_JUMP = 'reject_jump'        # implausibly large move into the KL area
+
+def _classify_location(device, new_lat, new_lng, location_unchanged):
+    """
+    Decide whether an incoming location is plausible. Returns a
+    (verdict, extra) tuple where verdict is one of the _LOC_* constants and
+    extra carries verdict-specific response data. All distances are computed
+    at most once, in squared space; the caller maps verdicts to responses.
+
+    The heuristics guard against ISP geolocation artifacts: providers here
+    resolve to Kuala Lumpur, so a sudden report from the KL area on a device
+    that was elsewhere (or has no GPS history) is treated as noise.
+    """
+    if not new_lat or not new_lng:
+        return _LOC_ACCEPT, None
+
+    dist_kl_sq = _fast_dist_sq_m(KL_LAT, KL_LNG, new_lat, new_lng)
+    if dist_kl_sq >= KL_RADIUS_SQ_M:
+        # Not in the KL area - real GPS, always accept
+        logging.info("✅ Accepting location update: New location is NOT in KL area (real GPS): %s, %s", new_lat, new_lng)
+        return _LOC_ACCEPT, None
+
+    # In the KL area: suspicious unless the device has KL history
+    if not device.last_lat or not device.last_lng:
+        logging.warning("Rejecting KL area location update (wrong IP geolocation): %s, %s", new_lat, new_lng)
+        return _LOC_REJECT_KL, None
+
+    prev_kl_sq = _fast_dist_sq_m(KL_LAT, KL_LNG, device.last_lat, device.last_lng)
+    if prev_kl_sq > KL_RADIUS_SQ_M:
+        # Device was elsewhere, now showing KL - this is wrong!
+        logging.warning("Rejecting KL location update - device was at %s, %s (not KL)", device.last_lat, device.last_lng)
+        return _LOC_REJECT_KL_JUMP, None
+
+    # Both old and new locations are in KL (device may genuinely be there);
+    # still reject implausibly large jumps on automatic updates
+    jump_sq = _fast_dist_sq_m(device.last_lat, device.last_lng, new_lat, new_lng)
+    if jump_sq > REJECT_JUMP_SQ_M and location_unchanged:
+        distance = math.sqrt(jump_sq)
+        logging.warning("Rejecting location update: device moved %.0fm to KL area, likely inaccurate IP geolocation", distance)
+        return _LOC_REJECT_JUMP, {'distance_meters': round(distance)}
+    if jump_sq > WARN_JUMP_SQ_M:
+        logging.warning("Large location change detected: %.0fm - accepting but may be inaccurate", math.sqrt(jump_sq))
+    return _LOC_ACCEPT, None
+
+def _slim_device(device):
+    """
+    Minimal device payload for rejected location updates - the client only
+    needs identity and current state there, not the full hardware dump.
+    """
+    return {
+        'device_id': device.device_id,
+        'status': device.status,
+        'last_lat': device.last_lat,
+        'last_lng': device.last_lng,
+        'last_seen': device.last_seen.isoformat() + 'Z' if device.last_seen else None
+    }
+
+# "Most recently signed-up user" answer for agent config polling, cached
+# briefly - fleets poll check_config_update every few seconds and the
+# ORDER BY created_at scan is identical across them
+_RECENT_USER_TTL = 10  # seconds
+_recent_user_cache = [0.0, None]  # [expires_at, email-or-None]
+
+def _recent_user_email():
+    """
+    Email of the most recent signup within the last 30 minutes, or None.
+    Cached for a few seconds so agent heartbeats share one SELECT.
+    """
+    now = time.monotonic()
+    if now < _recent_user_cache[0]:
+        return _recent_user_cache[1]
+    recent_cutoff = datetime.utcnow() - timedelta(minutes=30)
+    email = db.session.execute(
+        select(User.email)
+        .where(User.created_at >= recent_cutoff)
+        .order_by(User.created_at.desc())
+        .limit(1)
+    ).scalar()
+    _recent_user_cache[0] = now + _RECENT_USER_TTL
+    _recent_user_cache[1] = email
+    return email
+
 def calculate_distance_meters(lat1, lng1, lat2, lng2):
     """
     Calculate distance between two coordinates in meters using Haversine formula
@@ -26,12 +194,87 @@ def calculate_distance_meters(lat1, lng1, lat2, lng2):
     
     return R * c
 
+# Kuala Lumpur reference point used to reject ISP-geolocation artifacts in
+# update_location, plus the jump thresholds - all squared meters so they can
+# be compared straight against _fast_dist_sq_m()
+KL_LAT = 3.14
+KL_LNG = 101.69
+KL_RADIUS_SQ_M = 20000 ** 2   # 20 km: "in the KL area"
+REJECT_JUMP_SQ_M = 10000 ** 2  # 10 km: reject suspiciously large jumps
+WARN_JUMP_SQ_M = 5000 ** 2     # 5 km: log a warning but accept
+
+def _fast_dist_sq_m(lat1, lng1, lat2, lng2):
+    """
+    Squared distance in meters^2 between two coordinates using the
+    equirectangular approximation. Accurate to well under 1% at the
+    sub-100km scales our validation thresholds work at, and much cheaper
+    than full Haversine: one cos() and no sqrt, so thresholds can be
+    compared in squared space without ever taking a root.
+    """
+    # Wrap the longitude delta into [-180, 180) - unlike the Haversine
+    # half-angle form this approximation is not periodic on its own
+    dlng = (lng2 - lng1 + 180.0) % 360.0 - 180.0
+    x = math.radians(dlng) * math.cos(math.radians((lat1 + lat2) / 2.0))
+    y = math.radians(lat2 - lat1)
+    return (x * x + y * y) * (6371000.0 ** 2)
+
 def generate_connection_key():
-    """Generate a secure random connection key"""
-    return secrets.token_urlsafe(32)
+    """Generate a secure random connection key (192-bit, base64url encoded)"""
+    return base64.urlsafe_b64encode(secrets.token_bytes(24)).rstrip(b'=').decode('ascii')
+
+# Maps hardware payload sections to Device columns: (section, payload_key, column)
+# Shared by the agent registration endpoints so create and update paths
+# always stay in sync.
+HARDWARE_FIELD_MAP = (
+    ('os_info', 'os_name', 'os_name'),
+    ('os_info', 'os_version', 'os_version'),
+    ('os_info', 'hostname', 'hostname'),
+    ('os_info', 'architecture', 'architecture'),
+    ('system_info', 'vendor', 'brand'),
+    ('system_info', 'model', 'model_name'),
+    ('system_info', 'serial_number', 'serial_number'),
+    ('bios_info', 'vendor', 'bios_vendor'),
+    ('bios_info', 'version', 'bios_version'),
+    ('motherboard_info', 'vendor', 'motherboard_vendor'),
+    ('motherboard_info', 'model', 'motherboard_model'),
+    ('motherboard_info', 'serial_number', 'motherboard_serial'),
+    ('cpu_info', 'model', 'cpu_model'),
+    ('cpu_info', 'model', 'cpu_info'),  # Legacy field
+    ('cpu_info', 'cores', 'cpu_cores'),
+    ('cpu_info', 'threads', 'cpu_threads'),
+    ('cpu_info', 'speed_mhz', 'cpu_speed_mhz'),
+    ('ram_info', 'total_mb', 'ram_mb'),
+    ('ram_info', 'total_gb', 'ram_gb'),
+)
+
+def build_hardware_fields(sections):
+    """
+    Build a dict of Device column values from hardware payload sections
+    (os_info, system_info, bios_info, ...). Missing/None values are skipped,
+    so the result can be used both for Device(**fields) on create and for
+    setattr-based updates of an existing device.
+    """
+    fields = {}
+    for section, payload_key, column in HARDWARE_FIELD_MAP:
+        value = sections.get(section, {}).get(payload_key)
+        if value is not None:
+            fields[column] = value
+
+    # Network info is stored in native JSON columns - pull each list out once
+    # and bind it directly (the interfaces list can be large on multi-NIC hosts)
+    network_info = sections.get('network_info', {})
+    interfaces = network_info.get('interfaces')
+    if interfaces:
+        fields['network_interfaces'] = interfaces
+    mac_addresses = network_info.get('mac_addresses')
+    if mac_addresses:
+        fields['mac_addresses'] = mac_addresses
+
+    return fields
 
 @device_bp.route('/create_device', methods=['POST'])
 @jwt_required()
+@require_json_body()
 def create_device():
     """Create a new device manually (for connecting physical devices later)"""
     try:
@@ -65,16 +308,14 @@ def create_device():
         )
         
         db.session.add(device)
-        db.session.flush()  # Flush to get device.id before creating activity log
-        
-        # Log device creation
-        log = ActivityLog(
-            device_id=device.id,
+
+        # Log device creation - appending through the relationship lets the
+        # unit of work populate the FK and batch both INSERTs in one flush
+        device.activity_logs.append(ActivityLog(
             action='device_created',
             description=f'Device "{name}" created manually. Waiting for physical device connection.'
-        )
-        db.session.add(log)
-        
+        ))
+
         db.session.commit()
         
         return jsonify({
@@ -88,6 +329,7 @@ def create_device():
 
 @device_bp.route('/register_device', methods=['POST'])
 @jwt_required()
+@require_json_body()
 def register_device():
     """Register a new device (for auto-registration)"""
     try:
@@ -172,6 +414,7 @@ def register_device():
         return jsonify({'error': str(e)}), 500
 
 @device_bp.route('/agent_register_device', methods=['POST'])
+@require_json_body()
 def agent_register_device():
     """
     Register a physical device from the background agent using user email.
@@ -183,7 +426,7 @@ def agent_register_device():
         to that user account.
     """
     try:
-        data = request.get_json() or {}
+        data = _json_body()
         device_id = data.get('device_id')
         device_type = data.get('device_type', 'laptop')
         name = data.get('name') or device_id
@@ -235,6 +478,7 @@ def agent_register_device():
         return jsonify({'error': str(e)}), 500
 
 @device_bp.route('/devices/agent/register', methods=['POST'])
+@require_json_body()
 def agent_register_with_hardware():
     """
     Prey Project-style native agent registration with comprehensive hardware info.
@@ -288,140 +532,75 @@ def agent_register_with_hardware():
         }
     }
     """
+    # Parse phase - no session involvement, so malformed payloads return 400
+    # without triggering a pointless rollback
     try:
-        data = request.get_json() or {}
+        data = _json_body()
         device_id = data.get('device_id')
         user_email = data.get('user_email', 'admin@antitheft.com')
-        
+
         if not device_id:
             return jsonify({'error': 'device_id is required'}), 400
-        
-        # Find or create user
+
+        os_info = data.get('os_info', {})
+        system_info = data.get('system_info', {})
+        hardware_fields = build_hardware_fields(data)
+    except (TypeError, ValueError, KeyError) as e:
+        return jsonify({'error': f'Invalid payload: {e}'}), 400
+
+    # Persist phase - only database work, where a rollback actually matters
+    try:
         user = User.query.filter_by(email=user_email).first()
         if not user:
             return jsonify({'error': f'User with email {user_email} not found. Please sign up first.'}), 404
-        
-        # Parse hardware info
-        os_info = data.get('os_info', {})
-        system_info = data.get('system_info', {})
-        bios_info = data.get('bios_info', {})
-        motherboard_info = data.get('motherboard_info', {})
-        cpu_info = data.get('cpu_info', {})
-        ram_info = data.get('ram_info', {})
-        network_info = data.get('network_info', {})
-        
+
         # Check if device already exists
         device = Device.query.filter_by(device_id=device_id).first()
-        
+
         if device:
             # Update existing device with hardware info
             device.device_type = 'agent_device'
-            # Update fields if provided (use get with default to handle None/empty)
-            if os_info.get('os_name'):
-                device.os_name = os_info.get('os_name')
-            if os_info.get('os_version'):
-                device.os_version = os_info.get('os_version')
-            if os_info.get('hostname'):
-                device.hostname = os_info.get('hostname')
-            if os_info.get('architecture'):
-                device.architecture = os_info.get('architecture')
-            if system_info.get('vendor'):
-                device.brand = system_info.get('vendor')
-            if system_info.get('model'):
-                device.model_name = system_info.get('model')
-            if system_info.get('serial_number'):
-                device.serial_number = system_info.get('serial_number')
-            if bios_info.get('vendor'):
-                device.bios_vendor = bios_info.get('vendor')
-            if bios_info.get('version'):
-                device.bios_version = bios_info.get('version')
-            if motherboard_info.get('vendor'):
-                device.motherboard_vendor = motherboard_info.get('vendor')
-            if motherboard_info.get('model'):
-                device.motherboard_model = motherboard_info.get('model')
-            if motherboard_info.get('serial_number'):
-                device.motherboard_serial = motherboard_info.get('serial_number')
-            if cpu_info.get('model'):
-                device.cpu_model = cpu_info.get('model')
-                device.cpu_info = cpu_info.get('model')  # Legacy field
-            if cpu_info.get('cores') is not None:
-                device.cpu_cores = cpu_info.get('cores')
-            if cpu_info.get('threads') is not None:
-                device.cpu_threads = cpu_info.get('threads')
-            if cpu_info.get('speed_mhz') is not None:
-                device.cpu_speed_mhz = cpu_info.get('speed_mhz')
-            if ram_info.get('total_mb') is not None:
-                device.ram_mb = ram_info.get('total_mb')
-            if ram_info.get('total_gb') is not None:
-                device.ram_gb = ram_info.get('total_gb')
-            
-            # Store network info as JSON
-            if network_info.get('interfaces'):
-                device.network_interfaces = json.dumps(network_info['interfaces'])
-            if network_info.get('mac_addresses'):
-                device.mac_addresses = json.dumps(network_info['mac_addresses'])
-            
+            for column, value in hardware_fields.items():
+                setattr(device, column, value)
+
             device.status = 'active'
             device.last_seen = datetime.utcnow()
-            
-            logging.info(f"Updated device {device_id} with hardware information")
+
+            logging.info("Updated device %s with hardware information", device_id)
         else:
             # Create new device with hardware info
             device_name = system_info.get('model') or os_info.get('hostname') or device_id
             if system_info.get('vendor'):
                 device_name = f"{system_info['vendor']} {device_name}".strip()
-            
+
             device = Device(
                 device_id=device_id,
                 name=device_name,
                 device_type='agent_device',
                 user_id=user.id,
                 status='active',
-                os_name=os_info.get('os_name'),
-                os_version=os_info.get('os_version'),
-                hostname=os_info.get('hostname'),
-                architecture=os_info.get('architecture'),
-                brand=system_info.get('vendor'),
-                model_name=system_info.get('model'),
-                serial_number=system_info.get('serial_number'),
-                bios_vendor=bios_info.get('vendor'),
-                bios_version=bios_info.get('version'),
-                motherboard_vendor=motherboard_info.get('vendor'),
-                motherboard_model=motherboard_info.get('model'),
-                motherboard_serial=motherboard_info.get('serial_number'),
-                cpu_model=cpu_info.get('model'),
-                cpu_info=cpu_info.get('model'),  # Legacy field
-                cpu_cores=cpu_info.get('cores'),
-                cpu_threads=cpu_info.get('threads'),
-                cpu_speed_mhz=cpu_info.get('speed_mhz'),
-                ram_mb=ram_info.get('total_mb'),
-                ram_gb=ram_info.get('total_gb'),
-                network_interfaces=json.dumps(network_info.get('interfaces', [])) if network_info.get('interfaces') else None,
-                mac_addresses=json.dumps(network_info.get('mac_addresses', [])) if network_info.get('mac_addresses') else None
+                **hardware_fields
             )
-            
+
             db.session.add(device)
-            logging.info(f"Created new device {device_id} with hardware information")
-        
-        db.session.flush()
+            logging.info("Created new device %s with hardware information", device_id)
         
-        # Log registration
-        log = ActivityLog(
-            device_id=device.id,
+        # Log registration - appended via the relationship so both INSERTs
+        # go out in the same flush without an extra round trip
+        device.activity_logs.append(ActivityLog(
             action='device_registered',
             description=f'Device "{device.name}" registered/updated by native agent with full hardware info'
-        )
-        db.session.add(log)
+        ))
         db.session.commit()
         
         return jsonify({
             'message': 'Device registered successfully with hardware information',
             'device': device.to_dict()
         }), 200 if device.id else 201
-        
-    except Exception as e:
+
+    except SQLAlchemyError as e:
         db.session.rollback()
-        logging.error(f"Error in agent hardware registration: {e}")
+        logging.error("Error in agent hardware registration: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @device_bp.route('/devices/pending-link', methods=['GET'])
@@ -465,10 +644,11 @@ def get_pending_link_token():
             }), 200
         
     except Exception as e:
-        logging.error(f"Error getting pending link token: {e}")
+        logging.error("Error getting pending link token: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @device_bp.route('/devices/agent/auto-register', methods=['POST'])
+@require_json_body()
 def agent_auto_register():
     """
     Prey Project-style automatic device registration with hardware info.
@@ -486,100 +666,61 @@ def agent_auto_register():
         "network_info": {...}
     }
     """
+    # Parse phase - no session involvement, so malformed payloads return 400
+    # without triggering a pointless rollback
     try:
-        data = request.get_json() or {}
+        data = _json_body()
         token_value = data.get('device_link_token')
-        
+
         if not token_value:
             return jsonify({'error': 'device_link_token is required'}), 400
-        
-        # Validate token
-        token = DeviceLinkToken.query.filter_by(token=token_value).first()
+
+        os_info = data.get('os_info', {})
+        system_info = data.get('system_info', {})
+        hardware_fields = build_hardware_fields(data)
+
+        # Generate device_id from hardware info (use serial number if available, else random)
+        if system_info.get('serial_number') and system_info.get('serial_number') != 'Unknown':
+            # Use serial number as part of device_id for stability
+            hostname = os_info.get('hostname') or _HOSTNAME
+            device_id = f"{hostname}-{system_info['serial_number'][:8]}"
+        else:
+            # Fallback to a random 16-hex-char ID
+            device_id = f"device-{secrets.token_hex(8)}"
+    except (TypeError, ValueError, KeyError) as e:
+        return jsonify({'error': f'Invalid payload: {e}'}), 400
+
+    # Persist phase - only database work, where a rollback actually matters
+    try:
+        # Validate token - only the columns the checks below need
+        token = DeviceLinkToken.query.options(
+            load_only(DeviceLinkToken.user_id, DeviceLinkToken.used, DeviceLinkToken.expires_at)
+        ).filter_by(token_hash=DeviceLinkToken.hash_token(token_value)).first()
         if not token:
             return jsonify({'error': 'Invalid token'}), 400
         if token.used:
             return jsonify({'error': 'Token already used'}), 400
         if token.expires_at < datetime.utcnow():
             return jsonify({'error': 'Token expired'}), 400
-        
+
         user_id = token.user_id
-        user = User.query.get(user_id)
+        user = db.session.get(User, user_id)
         if not user:
             return jsonify({'error': 'User not found'}), 404
-        
-        # Parse hardware info
-        os_info = data.get('os_info', {})
-        system_info = data.get('system_info', {})
-        bios_info = data.get('bios_info', {})
-        motherboard_info = data.get('motherboard_info', {})
-        cpu_info = data.get('cpu_info', {})
-        ram_info = data.get('ram_info', {})
-        network_info = data.get('network_info', {})
-        
-        # Generate device_id from hardware info (use serial number if available, else UUID)
-        device_id = None
-        if system_info.get('serial_number') and system_info.get('serial_number') != 'Unknown':
-            # Use serial number as part of device_id for stability
-            import platform
-            hostname = os_info.get('hostname') or platform.node() or 'device'
-            device_id = f"{hostname}-{system_info['serial_number'][:8]}"
-        else:
-            # Fallback to UUID-based ID
-            import uuid
-            device_id = f"device-{uuid.uuid4().hex[:16]}"
-        
+
         # Check if device already exists for this user (same hardware)
         existing_device = Device.query.filter_by(device_id=device_id, user_id=user_id).first()
         
         if existing_device:
             # Update existing device with hardware info
             existing_device.device_type = 'agent_device'
-            if os_info.get('os_name'):
-                existing_device.os_name = os_info.get('os_name')
-            if os_info.get('os_version'):
-                existing_device.os_version = os_info.get('os_version')
-            if os_info.get('hostname'):
-                existing_device.hostname = os_info.get('hostname')
-            if os_info.get('architecture'):
-                existing_device.architecture = os_info.get('architecture')
-            if system_info.get('vendor'):
-                existing_device.brand = system_info.get('vendor')
-            if system_info.get('model'):
-                existing_device.model_name = system_info.get('model')
-            if system_info.get('serial_number'):
-                existing_device.serial_number = system_info.get('serial_number')
-            if bios_info.get('vendor'):
-                existing_device.bios_vendor = bios_info.get('vendor')
-            if bios_info.get('version'):
-                existing_device.bios_version = bios_info.get('version')
-            if motherboard_info.get('vendor'):
-                existing_device.motherboard_vendor = motherboard_info.get('vendor')
-            if motherboard_info.get('model'):
-                existing_device.motherboard_model = motherboard_info.get('model')
-            if motherboard_info.get('serial_number'):
-                existing_device.motherboard_serial = motherboard_info.get('serial_number')
-            if cpu_info.get('model'):
-                existing_device.cpu_model = cpu_info.get('model')
-                existing_device.cpu_info = cpu_info.get('model')
-            if cpu_info.get('cores') is not None:
-                existing_device.cpu_cores = cpu_info.get('cores')
-            if cpu_info.get('threads') is not None:
-                existing_device.cpu_threads = cpu_info.get('threads')
-            if cpu_info.get('speed_mhz') is not None:
-                existing_device.cpu_speed_mhz = cpu_info.get('speed_mhz')
-            if ram_info.get('total_mb') is not None:
-                existing_device.ram_mb = ram_info.get('total_mb')
-            if ram_info.get('total_gb') is not None:
-                existing_device.ram_gb = ram_info.get('total_gb')
-            if network_info.get('interfaces'):
-                existing_device.network_interfaces = json.dumps(network_info['interfaces'])
-            if network_info.get('mac_addresses'):
-                existing_device.mac_addresses = json.dumps(network_info['mac_addresses'])
-            
+            for column, value in hardware_fields.items():
+                setattr(existing_device, column, value)
+
             existing_device.status = 'active'
             existing_device.last_seen = datetime.utcnow()
             device = existing_device
-            logging.info(f"Updated existing device {device_id} with hardware information")
+            logging.info("Updated existing device %s with hardware information", device_id)
         else:
             # Create new device with hardware info
             device_name = system_info.get('model') or os_info.get('hostname') or device_id
@@ -594,58 +735,35 @@ def agent_auto_register():
                 device_type='agent_device',
                 user_id=user_id,
                 status='active',
-                os_name=os_info.get('os_name'),
-                os_version=os_info.get('os_version'),
-                hostname=os_info.get('hostname'),
-                architecture=os_info.get('architecture'),
-                brand=system_info.get('vendor'),
-                model_name=system_info.get('model'),
-                serial_number=system_info.get('serial_number'),
-                bios_vendor=bios_info.get('vendor'),
-                bios_version=bios_info.get('version'),
-                motherboard_vendor=motherboard_info.get('vendor'),
-                motherboard_model=motherboard_info.get('model'),
-                motherboard_serial=motherboard_info.get('serial_number'),
-                cpu_model=cpu_info.get('model'),
-                cpu_info=cpu_info.get('model'),
-                cpu_cores=cpu_info.get('cores'),
-                cpu_threads=cpu_info.get('threads'),
-                cpu_speed_mhz=cpu_info.get('speed_mhz'),
-                ram_mb=ram_info.get('total_mb'),
-                ram_gb=ram_info.get('total_gb'),
-                network_interfaces=json.dumps(network_info.get('interfaces', [])) if network_info.get('interfaces') else None,
-                mac_addresses=json.dumps(network_info.get('mac_addresses', [])) if network_info.get('mac_addresses') else None
+                **hardware_fields
             )
-            
+
             db.session.add(device)
-            logging.info(f"Created new device {device_id} with hardware information")
-        
-        db.session.flush()
+            logging.info("Created new device %s with hardware information", device_id)
         
         # Mark token as used
         token.used = True
         token.used_at = datetime.utcnow()
-        
-        # Log registration
-        log = ActivityLog(
-            device_id=device.id,
+
+        # Log registration (FK filled in by the relationship at flush time)
+        device.activity_logs.append(ActivityLog(
             action='device_registered',
             description=f'Device "{device.name}" auto-registered via native agent with hardware info'
-        )
-        db.session.add(log)
+        ))
         db.session.commit()
         
         return jsonify({
             'message': 'Device registered successfully',
             'device': device.to_dict()
         }), 200
-        
-    except Exception as e:
+
+    except SQLAlchemyError as e:
         db.session.rollback()
-        logging.error(f"Error in agent auto-register: {e}")
+        logging.error("Error in agent auto-register: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @device_bp.route('/agent/register', methods=['POST'])
+@require_json_body()
 def agent_register():
     """
     Prey Project-style Agent-First Registration
@@ -680,7 +798,7 @@ def agent_register():
     }
     """
     try:
-        data = request.get_json() or {}
+        data = _json_body()
         fingerprint_hash = data.get('fingerprint_hash')
         
         if not fingerprint_hash:
@@ -695,7 +813,7 @@ def agent_register():
             existing_device.device_type = 'agent_device'
             db.session.commit()
             
-            logging.info(f"Existing device found: {existing_device.device_id} (fingerprint: {fingerprint_hash[:16]}...)")
+            logging.info("Existing device found: %s (fingerprint: %s...)", existing_device.device_id, fingerprint_hash[:16])
             return jsonify({
                 'device_id': existing_device.device_id,
                 'message': 'Device already registered',
@@ -706,12 +824,8 @@ def agent_register():
         os_info = data.get('os_info', {})
         hardware_info = data.get('hardware_info', {})
         system_info = hardware_info.get('system_info', {})
-        bios_info = hardware_info.get('bios_info', {})
-        motherboard_info = hardware_info.get('motherboard_info', {})
-        cpu_info = hardware_info.get('cpu_info', {})
-        ram_info = hardware_info.get('ram_info', {})
-        network_info = hardware_info.get('network_info', {})
-        
+        hardware_fields = build_hardware_fields({'os_info': os_info, **hardware_info})
+
         # Generate device_id (use hostname + serial or UUID-based)
         hostname = os_info.get('hostname', 'device')
         serial = system_info.get('serial_number', '')
@@ -744,42 +858,19 @@ def agent_register():
             user_id=None,  # UNOWNED - will be linked later
             status='active',
             registered_at=datetime.utcnow(),
-            os_name=os_info.get('os_name'),
-            os_version=os_info.get('os_version'),
-            hostname=os_info.get('hostname'),
-            architecture=os_info.get('architecture'),
-            brand=system_info.get('vendor'),
-            model_name=system_info.get('model'),
-            serial_number=system_info.get('serial_number'),
-            bios_vendor=bios_info.get('vendor'),
-            bios_version=bios_info.get('version'),
-            motherboard_vendor=motherboard_info.get('vendor'),
-            motherboard_model=motherboard_info.get('model'),
-            motherboard_serial=motherboard_info.get('serial_number'),
-            cpu_model=cpu_info.get('model'),
-            cpu_info=cpu_info.get('model'),
-            cpu_cores=cpu_info.get('cores'),
-            cpu_threads=cpu_info.get('threads'),
-            cpu_speed_mhz=cpu_info.get('speed_mhz'),
-            ram_mb=ram_info.get('total_mb'),
-            ram_gb=ram_info.get('total_gb'),
-            network_interfaces=json.dumps(network_info.get('interfaces', [])) if network_info.get('interfaces') else None,
-            mac_addresses=json.dumps(network_info.get('mac_addresses', [])) if network_info.get('mac_addresses') else None
+            **hardware_fields
         )
         
         db.session.add(device)
-        db.session.flush()
-        
-        # Log registration
-        log = ActivityLog(
-            device_id=device.id,
+
+        # Log registration - relationship append batches both INSERTs in one flush
+        device.activity_logs.append(ActivityLog(
             action='device_registered',
             description=f'Device "{device.name}" registered by agent (unowned, awaiting user link)'
-        )
-        db.session.add(log)
+        ))
         db.session.commit()
         
-        logging.info(f"New device registered: {device_id} (fingerprint: {fingerprint_hash[:16]}...)")
+        logging.info("New device registered: %s (fingerprint: %s...)", device_id, fingerprint_hash[:16])
         
         return jsonify({
             'device_id': device_id,
@@ -788,36 +879,81 @@ def agent_register():
         
     except Exception as e:
         db.session.rollback()
-        logging.error(f"Error in agent registration: {e}")
+        logging.error("Error in agent registration: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @device_bp.route('/update_location', methods=['POST'])
+@require_json_body()
 def update_location():
     """Update device location - can be called by device agent without auth"""
     try:
-        data = request.get_json()
-        
+        data = _json_body()
+
         if not data or not data.get('device_id'):
             return jsonify({'error': 'device_id is required'}), 400
+
+        # One timestamp per request - reused everywhere below so related
+        # fields (last_seen, last_location_update, missing windows) agree
+        now = datetime.utcnow()
         
-        device = Device.query.filter_by(device_id=data['device_id']).first()
+        # Eager-load the owner in the same SELECT - the breach paths below
+        # need the owner's email and shouldn't pay a second round trip for it
+        device = db.session.execute(
+            select(Device)
+            .options(joinedload(Device.owner))
+            .where(Device.device_id == data['device_id'])
+        ).scalar_one_or_none()
         if not device:
             # Auto-register device to avoid manual "Add Device" step.
             # Attach to the first available user (typically the account that owns the system).
-            owner = User.query.filter_by(email='admin@antitheft.com').first() or User.query.first()
-            if not owner:
+            owner_id = _default_owner_id()
+            if owner_id is None:
                 return jsonify({'error': 'Device not found and no owner user exists'}), 404
 
             device = Device(
                 device_id=data['device_id'],
                 name=data.get('device_name', data['device_id']),
                 device_type=data.get('device_type', 'laptop'),
-                user_id=owner.id,
+                user_id=owner_id,
                 status=data.get('status', 'active')
             )
             db.session.add(device)
+            # Flush (not commit) so device.id is available for the activity
+            # logs below - the single commit on the exit path persists it
+            db.session.flush()
+
+        # Dedupe stationary agents: identical coordinates and status inside a
+        # short window mean nothing below would change except last_seen, so
+        # touch that with one lightweight UPDATE and skip the validation,
+        # logging and full-row write entirely
+        _loc = data.get('location') or {}
+        if (
+            _loc.get('lat') is not None
+            and _loc.get('lat') == device.last_lat
+            and _loc.get('lng') == device.last_lng
+            and (not data.get('status') or data.get('status') == device.status)
+            and not data.get('wifi_geofence_breach')
+            and 'battery_percentage' not in data
+            and (
+                not data.get('current_wifi_ssid')
+                or data.get('current_wifi_ssid') == device.current_wifi_ssid
+            )
+            and device.last_seen is not None
+            and (now - device.last_seen).total_seconds() < 30
+        ):
+            Device.query.filter_by(id=device.id).update(
+                {'last_seen': now}, synchronize_session=False
+            )
             db.session.commit()
-        
+            return jsonify({
+                'message': 'Location unchanged',
+                'device': _slim_device(device)
+            }), 200
+
+        # Activity log payloads accumulate here as plain dicts and are
+        # flushed as one executemany INSERT by whichever path returns
+        pending_logs = []
+
         # CRITICAL: Handle status updates FIRST, before location validation
         # This ensures status updates (like unlock: locked -> active) always work,
         # even if location is rejected or missing
@@ -828,107 +964,59 @@ def update_location():
             
             # Log status change if it changed
             if old_status != incoming_status:
-                logging.info(f"📊 Device status updated: {old_status} -> {incoming_status} (device_id: {device.device_id})")
+                logging.info("📊 Device status updated: %s -> %s (device_id: %s)", old_status, incoming_status, device.device_id)
                 
                 # If device was locked and now active, log unlock
                 if old_status == 'locked' and incoming_status == 'active':
-                    unlock_log = ActivityLog(
-                        device_id=device.id,
-                        action='unlock',
-                        description=f'Device unlocked. Status changed from locked to active',
-                        lat=None,  # Location may not be available yet
-                        lng=None
-                    )
-                    db.session.add(unlock_log)
-                    logging.info(f"🔓 Device unlocked successfully: {device.device_id}")
+                    pending_logs.append({
+                        'device_id': device.id,
+                        'action': 'unlock',
+                        'description': 'Device unlocked. Status changed from locked to active',
+                        'lat': None,  # Location may not be available yet
+                        'lng': None
+                    })
+                    logging.info("🔓 Device unlocked successfully: %s", device.device_id)
                 # If device was in alarm and now sends a non-alarm status, log alarm cleared
                 elif old_status == 'alarm' and incoming_status != 'alarm':
-                    clear_log = ActivityLog(
-                        device_id=device.id,
-                        action='alarm_cleared',
-                        description=f'Alarm cleared: Device status updated to {incoming_status}',
-                        lat=None,
-                        lng=None
-                    )
-                    db.session.add(clear_log)
-        
+                    pending_logs.append({
+                        'device_id': device.id,
+                        'action': 'alarm_cleared',
+                        'description': f'Alarm cleared: Device status updated to {incoming_status}',
+                        'lat': None,
+                        'lng': None
+                    })
+
         location = data.get('location', {})
         new_lat = location.get('lat')
         new_lng = location.get('lng')
         
-        # CRITICAL: Reject KL area locations (wrong ISP location)
-        # KL coordinates: ~3.14, 101.69
-        # BUT: Always accept locations NOT in KL area (they're real GPS)
-        if new_lat and new_lng:
-            kl_area_lat = 3.14
-            kl_area_lng = 101.69
-            distance_from_kl = calculate_distance_meters(kl_area_lat, kl_area_lng, new_lat, new_lng)
-            
-            # If location is NOT in KL area, always accept it (it's real GPS)
-            if distance_from_kl >= 20000:
-                logging.info(f"✅ Accepting location update: New location is NOT in KL area (real GPS): {new_lat}, {new_lng}")
-                # Continue to update - don't reject
-            # If location is in KL area (within 20km) and device doesn't have a previous GPS location,
-            # this is definitely wrong IP geolocation - reject it
-            elif distance_from_kl < 20000:
-                if not device.last_lat or not device.last_lng:
-                    # No previous location - reject KL IP geolocation
-                    logging.warning(f"Rejecting KL area location update (wrong IP geolocation): {new_lat}, {new_lng}")
-                    # Commit status update before returning (status was already updated above)
-                    db.session.commit()
-                    return jsonify({
-                        'message': 'Location update rejected - KL area IP geolocation is inaccurate',
-                        'error': 'Please enable Windows Location Services for accurate GPS tracking',
-                        'device': device.to_dict()
-                    }), 200  # Return 200 but don't update location
-                else:
-                    # Check if previous location was also in KL
-                    prev_dist_from_kl = calculate_distance_meters(kl_area_lat, kl_area_lng, device.last_lat, device.last_lng)
-                    if prev_dist_from_kl > 20000:  # Previous location was NOT in KL
-                        # Device was elsewhere, now showing KL - this is wrong!
-                        logging.warning(f"Rejecting KL location update - device was at {device.last_lat}, {device.last_lng} (not KL)")
-                        # Commit status update before returning (status was already updated above)
-                        db.session.commit()
-                        return jsonify({
-                            'message': 'Location update rejected - KL area IP geolocation is inaccurate',
-                            'error': 'Device location jumped to KL area (ISP location), rejecting update',
-                            'device': device.to_dict()
-                        }), 200  # Return 200 but don't update location
-                    # else: both locations are in KL, might be correct (device actually in KL)
-        
-        # Validate location accuracy - reject if location changed too dramatically
-        # This prevents IP geolocation drift from causing false alarms
-        # BUT: Always accept if new location is NOT in KL area (it's likely real GPS)
-        if device.last_lat and device.last_lng and new_lat and new_lng:
-            distance = calculate_distance_meters(
-                device.last_lat, device.last_lng,
-                new_lat, new_lng
-            )
-            
-            # Check if new location is in KL area
-            kl_area_lat = 3.14
-            kl_area_lng = 101.69
-            new_dist_from_kl = calculate_distance_meters(kl_area_lat, kl_area_lng, new_lat, new_lng)
-            
-            # If new location is NOT in KL area, always accept it (it's real GPS, not ISP location)
-            if new_dist_from_kl >= 20000:
-                logging.info(f"Accepting location update: New location is NOT in KL area (real GPS): {new_lat}, {new_lng}")
-                # Continue to update - don't reject
-            # If location changed by more than 10km, it's likely inaccurate (IP geolocation issue)
-            # Only reject if it's not a manual update AND new location is in KL area
-            elif distance > 10000 and data.get('location_unchanged') and new_dist_from_kl < 20000:
-                logging.warning(f"Rejecting location update: device moved {distance:.0f}m to KL area, likely inaccurate IP geolocation")
-                # Commit status update before returning (status was already updated above)
-                db.session.commit()
-                return jsonify({
+        # Single flat decision on whether this location is plausible - all the
+        # KL-area/jump heuristics live in _classify_location()
+        verdict, extra = _classify_location(device, new_lat, new_lng, data.get('location_unchanged'))
+        if verdict is not _LOC_ACCEPT:
+            # Single commit persists the status update and any status logs
+            if pending_logs:
+                db.session.execute(ActivityLog.__table__.insert(), pending_logs)
+            db.session.commit()
+            if verdict is _LOC_REJECT_JUMP:
+                response = {
                     'message': 'Location update rejected - location change too large, likely inaccurate',
-                    'distance_meters': round(distance),
-                    'device': device.to_dict()
-                }), 200  # Return 200 but don't update location
-            
-            # If location changed by more than 5km and less than 10km, log warning but accept
-            elif distance > 5000:
-                logging.warning(f"Large location change detected: {distance:.0f}m - accepting but may be inaccurate")
+                    'distance_meters': extra['distance_meters'],
+                    'device': _slim_device(device)
+                }
+            elif verdict is _LOC_REJECT_KL:
+                response = {
+                    'message': 'Location update rejected - KL area IP geolocation is inaccurate',
+                    'error': 'Please enable Windows Location Services for accurate GPS tracking',
+                    'device': _slim_device(device)
+                }
+            else:  # _LOC_REJECT_KL_JUMP
+                response = {
+                    'message': 'Location update rejected - KL area IP geolocation is inaccurate',
+                    'error': 'Device location jumped to KL area (ISP location), rejecting update',
+                    'device': _slim_device(device)
+                }
+            return jsonify(response), 200  # Return 200 but don't update location
         
         # Check geofence BEFORE updating location (if enabled)
         geofence_breach = False
@@ -955,39 +1043,36 @@ def update_location():
                     alarm_triggered = True
                     
                     # Log geofence breach and alarm
-                    breach_log = ActivityLog(
-                        device_id=device.id,
-                        action='geofence_breach',
-                        description=f'Device left geofence! Distance: {distance_m:.1f}m outside radius ({device.geofence_radius_m}m)',
-                        lat=new_lat,
-                        lng=new_lng
-                    )
-                    db.session.add(breach_log)
-                    
-                    alarm_log = ActivityLog(
-                        device_id=device.id,
-                        action='alarm',
-                        description=f'Auto-triggered alarm: Device breached geofence (moved {distance_m:.1f}m outside {device.geofence_radius_m}m radius)',
-                        lat=new_lat,
-                        lng=new_lng
-                    )
-                    db.session.add(alarm_log)
-                
+                    pending_logs.append({
+                        'device_id': device.id,
+                        'action': 'geofence_breach',
+                        'description': f'Device left geofence! Distance: {distance_m:.1f}m outside radius ({device.geofence_radius_m}m)',
+                        'lat': new_lat,
+                        'lng': new_lng
+                    })
+
+                    pending_logs.append({
+                        'device_id': device.id,
+                        'action': 'alarm',
+                        'description': f'Auto-triggered alarm: Device breached geofence (moved {distance_m:.1f}m outside {device.geofence_radius_m}m radius)',
+                        'lat': new_lat,
+                        'lng': new_lng
+                    })
+
                 # Check if device returned to safe zone (was outside/alarm, now inside)
                 elif not device.was_inside_geofence and is_inside and device.status == 'alarm':
                     # Clear alarm status - device is back inside geofence
                     device.status = 'active'
                     
                     # Log alarm cleared
-                    clear_log = ActivityLog(
-                        device_id=device.id,
-                        action='alarm_cleared',
-                        description=f'Alarm cleared: Device returned to geofence (now {distance_m:.1f}m inside {device.geofence_radius_m}m radius)',
-                        lat=new_lat,
-                        lng=new_lng
-                    )
-                    db.session.add(clear_log)
-                
+                    pending_logs.append({
+                        'device_id': device.id,
+                        'action': 'alarm_cleared',
+                        'description': f'Alarm cleared: Device returned to geofence (now {distance_m:.1f}m inside {device.geofence_radius_m}m radius)',
+                        'lat': new_lat,
+                        'lng': new_lng
+                    })
+
                 # Update geofence state
                 device.was_inside_geofence = is_inside
         
@@ -999,20 +1084,26 @@ def update_location():
                 new_lng = float(new_lng)
                 # Validate ranges: lat must be -90 to 90, lng must be -180 to 180
                 if not (-90 <= new_lat <= 90) or not (-180 <= new_lng <= 180):
-                    logging.warning(f"Invalid coordinate ranges: lat={new_lat}, lng={new_lng}")
+                    logging.warning("Invalid coordinate ranges: lat=%s, lng=%s", new_lat, new_lng)
                     return jsonify({'error': 'Invalid coordinate ranges'}), 400
             except (ValueError, TypeError):
-                logging.warning(f"Invalid coordinate types: lat={new_lat}, lng={new_lng}")
+                logging.warning("Invalid coordinate types: lat=%s, lng=%s", new_lat, new_lng)
                 return jsonify({'error': 'Invalid coordinate types'}), 400
         
+        # Capture the previous coordinates before overwriting them - the old
+        # code logged "previous" after the mutation and printed the new values
+        prev_lat, prev_lng = device.last_lat, device.last_lng
         device.last_lat = new_lat
         device.last_lng = new_lng
-        device.last_location_update = datetime.utcnow()
-        
-        # Log the coordinates being stored for debugging
-        logging.info(f"Storing location for device {device.device_id}: lat={new_lat}, lng={new_lng}")
-        logging.info(f"Previous location was: lat={device.last_lat}, lng={device.last_lng}")
-        device.last_seen = datetime.utcnow()
+        device.last_seen = now
+        device.last_location_update = now
+
+        # One gated log line instead of two unconditional ones
+        if logging.getLogger().isEnabledFor(logging.INFO):
+            logging.info(
+                "Storing location for device %s: %s,%s -> %s,%s",
+                device.device_id, prev_lat, prev_lng, new_lat, new_lng
+            )
         
         # Update current WiFi SSID if provided
         if data.get('current_wifi_ssid'):
@@ -1027,9 +1118,9 @@ def update_location():
                     # Validate battery percentage is between 0-100
                     if 0 <= battery_percentage <= 100:
                         device.battery_percentage = battery_percentage
-                        logging.debug(f"Updated battery percentage for device {device.device_id}: {battery_percentage}%")
+                        logging.debug("Updated battery percentage for device %s: %s%%", device.device_id, battery_percentage)
                 except (ValueError, TypeError):
-                    logging.warning(f"Invalid battery percentage value: {battery_percentage}")
+                    logging.warning("Invalid battery percentage value: %s", battery_percentage)
         
         # Handle WiFi geofence breach (from device agent)
         wifi_geofence_breach = data.get('wifi_geofence_breach', False)
@@ -1043,30 +1134,29 @@ def update_location():
             alarm_triggered = True
             
             # Log WiFi geofence breach
-            breach_log = ActivityLog(
-                device_id=device.id,
-                action='wifi_geofence_breach',
-                description=f'WiFi Geofence Breach: Device disconnected from required network "{required_ssid}". Current: {current_ssid}',
-                lat=new_lat,
-                lng=new_lng
-            )
-            db.session.add(breach_log)
-            
+            pending_logs.append({
+                'device_id': device.id,
+                'action': 'wifi_geofence_breach',
+                'description': f'WiFi Geofence Breach: Device disconnected from required network "{required_ssid}". Current: {current_ssid}',
+                'lat': new_lat,
+                'lng': new_lng
+            })
+
             # Log alarm triggered
-            alarm_log = ActivityLog(
-                device_id=device.id,
-                action='alarm',
-                description=f'🚨 ALARM TRIGGERED: Device stolen or moved out of WiFi range! Disconnected from "{required_ssid}"',
-                lat=new_lat,
-                lng=new_lng
-            )
-            db.session.add(alarm_log)
-            
-            # Send notification to user
+            pending_logs.append({
+                'device_id': device.id,
+                'action': 'alarm',
+                'description': f'🚨 ALARM TRIGGERED: Device stolen or moved out of WiFi range! Disconnected from "{required_ssid}"',
+                'lat': new_lat,
+                'lng': new_lng
+            })
+
+            # Send notification to user in the background - SMTP latency must
+            # not hold up the agent's location POST (send_geofence_alert
+            # queues on the shared email executor itself)
             try:
-                from models import User
                 from utils.email_alert import send_geofence_alert
-                user = User.query.get(device.user_id)
+                user = device.owner
                 if user and user.email:
                     send_geofence_alert(
                         user.email,
@@ -1082,25 +1172,29 @@ def update_location():
                             'reason': breach_details.get('reason', 'WiFi geofence breach detected')
                         }
                     )
-                    logging.info(f"Notification sent to {user.email} for WiFi geofence breach")
+                    logging.info("Notification queued for %s for WiFi geofence breach", user.email)
             except Exception as e:
-                logging.error(f"Error sending notification: {e}")
+                logging.error("Error sending notification: %s", e)
         
         # Status was already updated at the beginning of the function
         # But if alarm was triggered by geofence, it will override the status
         # This is intentional - geofence alarms take priority
         
         # Log location update
-        log = ActivityLog(
-            device_id=device.id,
-            action='location_update',
-            description=f'Location updated: {new_lat}, {new_lng}' + (' - ALARM TRIGGERED!' if alarm_triggered else ''),
-            lat=new_lat,
-            lng=new_lng
-        )
-        db.session.add(log)
+        pending_logs.append({
+            'device_id': device.id,
+            'action': 'location_update',
+            'description': f'Location updated: {new_lat}, {new_lng}' + (' - ALARM TRIGGERED!' if alarm_triggered else ''),
+            'lat': new_lat,
+            'lng': new_lng
+        })
+
+        # One multi-row INSERT + commit for the whole request - the Core
+        # executemany fast path skips ORM identity-map bookkeeping entirely
+        # for rows that are never read back
+        db.session.execute(ActivityLog.__table__.insert(), pending_logs)
         db.session.commit()
-        
+
         response_data = {
             'message': 'Location updated',
             'device': device.to_dict()
@@ -1131,9 +1225,11 @@ def check_config_update(device_id):
     """
     try:
         # Check if there's a device registered with this device_id
-        device = Device.query.filter_by(device_id=device_id).first()
+        device = db.session.execute(
+            select(Device).where(Device.device_id == device_id)
+        ).scalar_one_or_none()
         if device:
-            user = User.query.get(device.user_id)
+            user = db.session.get(User, device.user_id)
             if user:
                 return jsonify({
                     'has_update': True,
@@ -1143,19 +1239,18 @@ def check_config_update(device_id):
         
         # Also check for recently registered users (within last 30 minutes)
         # This helps with auto-setup when user just registered
-        # Extended to 30 minutes to give more time for agent to check
-        recent_cutoff = datetime.utcnow() - timedelta(minutes=30)
-        recent_users = User.query.filter(User.created_at >= recent_cutoff).order_by(User.created_at.desc()).limit(1).all()
-        
+        # The lookup is cached for a few seconds across the whole fleet
+        recent_email = _recent_user_email()
+
         # If there's a recent user and no device registered yet, suggest the most recent user
         # The agent can try updating to this email and see if registration succeeds
-        if recent_users and not device:
+        if recent_email and not device:
             # Return the most recently registered user's email
             # Agent will try updating config and registering
-            logging.info(f"Suggesting auto-setup: device_id={device_id}, suggested_email={recent_users[0].email}")
+            logging.info("Suggesting auto-setup: device_id=%s, suggested_email=%s", device_id, recent_email)
             return jsonify({
                 'has_update': True,
-                'user_email': recent_users[0].email,
+                'user_email': recent_email,
                 'device_id': device_id,
                 'suggested': True  # Indicates this is a suggestion, not a confirmed match
             }), 200
@@ -1173,31 +1268,50 @@ def get_device_status(device_id):
     If JWT provided, returns full device details
     """
     try:
-        device = Device.query.filter_by(device_id=device_id).first()
+        user_id = get_jwt_identity()
+
+        # For agent access without JWT, return limited info - select just the
+        # six returned columns instead of hydrating the full row (hardware
+        # JSON columns can run to kilobytes)
+        if not user_id:
+            row = db.session.execute(
+                select(
+                    Device.device_id, Device.status, Device.is_missing,
+                    Device.geofence_enabled, Device.geofence_type,
+                    Device.geofence_wifi_ssid
+                ).where(Device.device_id == device_id)
+            ).one_or_none()
+            if row is None:
+                return jsonify({'error': 'Device not found'}), 404
+            return jsonify(dict(row._mapping)), 200
+
+        # JWT provided: verify ownership and return full device details
+        device = db.session.execute(
+            select(Device).where(Device.device_id == device_id)
+        ).scalar_one_or_none()
         if not device:
             return jsonify({'error': 'Device not found'}), 404
-        
-        # If JWT provided, verify ownership
-        user_id = get_jwt_identity()
-        if user_id:
-            user_id = int(user_id) if isinstance(user_id, str) else user_id
-            if device.user_id != user_id:
-                return jsonify({'error': 'Unauthorized'}), 403
-            return jsonify(device.to_dict()), 200
-        
-        # For agent access without JWT, return limited info
-        return jsonify({
-            'device_id': device.device_id,
-            'status': device.status,
-            'is_missing': device.is_missing,
-            'geofence_enabled': device.geofence_enabled,
-            'geofence_type': device.geofence_type,
-            'geofence_wifi_ssid': device.geofence_wifi_ssid
-        }), 200
-        
+
+        user_id = int(user_id) if isinstance(user_id, str) else user_id
+        if device.user_id != user_id:
+            return jsonify({'error': 'Unauthorized'}), 403
+        return jsonify(device.to_dict()), 200
+
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Columns the device-list consumers (dashboard, devices page, missing mode)
+# actually render - get_devices projects just these instead of hydrating and
+# serializing full ORM rows
+_DEVICE_LIST_COLUMNS = (
+    Device.id, Device.device_id, Device.name, Device.device_type,
+    Device.status, Device.is_missing, Device.missing_since,
+    Device.last_lat, Device.last_lng, Device.last_seen,
+    Device.battery_percentage, Device.created_at,
+    Device.os, Device.os_name, Device.os_version,
+)
+_DEVICE_LIST_DT_KEYS = ('missing_since', 'last_seen', 'created_at')
+
 @device_bp.route('/get_devices', methods=['GET'])
 @jwt_required()
 def get_devices():
@@ -1205,12 +1319,21 @@ def get_devices():
     try:
         user_id = get_jwt_identity()
         user_id = int(user_id) if isinstance(user_id, str) else user_id
-        
-        devices = Device.query.filter_by(user_id=user_id).all()
-        
-        return jsonify({
-            'devices': [device.to_dict() for device in devices]
-        }), 200
+
+        rows = db.session.execute(
+            select(*_DEVICE_LIST_COLUMNS).where(Device.user_id == user_id)
+        ).mappings()
+
+        devices = []
+        for row in rows:
+            d = dict(row)
+            # Same UTC 'Z' convention as Device.to_dict()
+            for key in _DEVICE_LIST_DT_KEYS:
+                if d[key] is not None:
+                    d[key] = d[key].isoformat() + 'Z'
+            devices.append(d)
+
+        return jsonify({'devices': devices}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1230,7 +1353,9 @@ def trigger_action():
         if not device_id or not action:
             return jsonify({'error': 'device_id and action are required'}), 400
         
-        device = Device.query.filter_by(device_id=device_id, user_id=user_id).first()
+        device = db.session.execute(
+            select(Device).where(Device.device_id == device_id, Device.user_id == user_id)
+        ).scalar_one_or_none()
         if not device:
             return jsonify({'error': 'Device not found'}), 404
 
@@ -1246,10 +1371,9 @@ def trigger_action():
             device.status = 'alarm'
         elif action == 'wipe':
             device.status = 'wiped'
-        
-        db.session.commit()
-        
-        # Create activity log with action details
+
+        # Create activity log with action details (status change and log are
+        # committed together - one fsync per action)
         description = f'Remote {action} action triggered by user'
         if action == 'lock':
             # Get password exactly as sent (preserve case and all characters)
@@ -1265,8 +1389,9 @@ def trigger_action():
             action=action,
             description=description
         )
-        
-        db.session.add(log)
+
+        # Bulk save skips unit-of-work bookkeeping for write-only log rows
+        db.session.bulk_save_objects([log])
         db.session.commit()
         
         return jsonify({
@@ -1292,26 +1417,35 @@ def update_device():
         if not device_id or not name:
             return jsonify({'error': 'device_id and name are required'}), 400
         
-        device = Device.query.filter_by(device_id=device_id, user_id=user_id).first()
-        if not device:
+        # Core UPDATE: one round trip performs the ownership check (via
+        # rowcount) and the mutation - no ORM object load or change tracking
+        row = db.session.execute(
+            update(Device)
+            .where(Device.device_id == device_id, Device.user_id == user_id)
+            .values(name=name)
+            .returning(Device.id, Device.device_id, Device.name, Device.status)
+        ).first()
+        if row is None:
+            db.session.rollback()
             return jsonify({'error': 'Device not found'}), 404
-        
-        old_name = device.name
-        device.name = name
-        db.session.commit()
-        
+
         # Log rename
         log = ActivityLog(
-            device_id=device.id,
+            device_id=row.id,
             action='device_renamed',
-            description=f'Device renamed from "{old_name}" to "{name}"'
+            description=f'Device renamed to "{name}"'
         )
-        db.session.add(log)
+        db.session.bulk_save_objects([log])
         db.session.commit()
-        
+
         return jsonify({
             'message': 'Device updated successfully',
-            'device': device.to_dict()
+            'device': {
+                'id': row.id,
+                'device_id': row.device_id,
+                'name': row.name,
+                'status': row.status
+            }
         }), 200
         
     except Exception as e:
@@ -1329,15 +1463,16 @@ def delete_device():
         if not device_id:
             return jsonify({'error': 'device_id is required'}), 400
         
-        device = Device.query.filter_by(device_id=device_id, user_id=user_id).first()
+        device = db.session.execute(
+            select(Device).where(Device.device_id == device_id, Device.user_id == user_id)
+        ).scalar_one_or_none()
         if not device:
             return jsonify({'error': 'Device not found'}), 404
         
-        # Delete all activity logs first
-        ActivityLog.query.filter_by(device_id=device.id).delete()
-        
-        # Delete device
-        db.session.delete(device)
+        # Bulk-delete logs and device without syncing session state - nothing
+        # here is read again after the delete, so skip the preload SELECT
+        ActivityLog.query.filter_by(device_id=device.id).delete(synchronize_session=False)
+        Device.query.filter_by(id=device.id).delete(synchronize_session=False)
         db.session.commit()
         
         return jsonify({'message': 'Device deleted successfully'}), 200
@@ -1358,7 +1493,9 @@ def mark_as_missing():
         if not device_id:
             return jsonify({'error': 'device_id is required'}), 400
         
-        device = Device.query.filter_by(device_id=device_id, user_id=user_id).first()
+        device = db.session.execute(
+            select(Device).where(Device.device_id == device_id, Device.user_id == user_id)
+        ).scalar_one_or_none()
         if not device:
             return jsonify({'error': 'Device not found'}), 404
         
@@ -1377,16 +1514,14 @@ def mark_as_missing():
             device.status = 'missing'
             action = 'missing_mode_activated'
             description = 'Device marked as missing - tracking activated'
-        
-        db.session.commit()
-        
-        # Log the action
+
+        # Log the action (committed together with the toggle - one fsync)
         log = ActivityLog(
             device_id=device.id,
             action=action,
             description=description
         )
-        db.session.add(log)
+        db.session.bulk_save_objects([log])
         db.session.commit()
         
         return jsonify({
@@ -1401,114 +1536,109 @@ def mark_as_missing():
 @jwt_required()
 def set_geofence():
     """Set geofence for a device"""
-    try:
-        data = request.get_json()
-        user_id = get_jwt_identity()
-        user_id = int(user_id) if isinstance(user_id, str) else user_id
-        
-        device_id = data.get('device_id')
-        if not device_id:
-            return jsonify({'error': 'device_id is required'}), 400
-        
-        device = Device.query.filter_by(device_id=device_id, user_id=user_id).first()
-        if not device:
-            return jsonify({'error': 'Device not found'}), 404
-        
-        # Update geofence settings
-        if 'center_lat' in data and 'center_lng' in data:
-            device.geofence_center_lat = data['center_lat']
-            device.geofence_center_lng = data['center_lng']
-        
-        if 'radius_m' in data:
-            device.geofence_radius_m = float(data['radius_m'])
-        elif device.geofence_radius_m is None:
-            device.geofence_radius_m = 200.0  # Default 200m
-        
-        if 'geofence_type' in data:
-            device.geofence_type = data['geofence_type']  # 'gps' or 'wifi'
-        
-        if 'wifi_ssid' in data:
-            device.geofence_wifi_ssid = data['wifi_ssid']
-        
-        if 'enabled' in data:
-            device.geofence_enabled = bool(data['enabled'])
-        
-        # Initialize was_inside_geofence based on geofence type
-        if device.geofence_enabled:
-            if device.geofence_type == 'gps' and device.last_lat and device.last_lng and device.geofence_center_lat and device.geofence_center_lng:
-                radius_km = device.geofence_radius_m / 1000.0
-                geofence_config = {
-                    'center_lat': device.geofence_center_lat,
-                    'center_lng': device.geofence_center_lng,
-                    'radius_km': radius_km
-                }
-                is_inside, _ = check_geofence(device.last_lat, device.last_lng, geofence_config)
-                device.was_inside_geofence = is_inside
-            elif device.geofence_type == 'wifi' and device.geofence_wifi_ssid:
-                # For WiFi, assume device is "inside" if it's connected to the required network
-                # The agent will check this and update the status
-                device.was_inside_geofence = True
-        
-        # Log geofence update
-        log = ActivityLog(
-            device_id=device.id,
-            action='geofence_updated',
-            description=f'Geofence {"enabled" if device.geofence_enabled else "disabled"}: Type={device.geofence_type}, Radius={device.geofence_radius_m}m'
-        )
-        db.session.add(log)
+    data = request.get_json()
+    user_id = get_jwt_identity()
+    user_id = int(user_id) if isinstance(user_id, str) else user_id
+    
+    device_id = data.get('device_id')
+    if not device_id:
+        return jsonify({'error': 'device_id is required'}), 400
+    
+    device = db.session.scalar(
+        select(Device).where(Device.device_id == device_id, Device.user_id == user_id)
+    )
+    if not device:
+        return jsonify({'error': 'Device not found'}), 404
+    
+    # Update geofence settings
+    if 'center_lat' in data and 'center_lng' in data:
+        device.geofence_center_lat = data['center_lat']
+        device.geofence_center_lng = data['center_lng']
+    
+    if 'radius_m' in data:
+        device.geofence_radius_m = float(data['radius_m'])
+    elif device.geofence_radius_m is None:
+        device.geofence_radius_m = 200.0  # Default 200m
+    
+    if 'geofence_type' in data:
+        device.geofence_type = data['geofence_type']  # 'gps' or 'wifi'
+    
+    if 'wifi_ssid' in data:
+        device.geofence_wifi_ssid = data['wifi_ssid']
+    
+    if 'enabled' in data:
+        device.geofence_enabled = bool(data['enabled'])
+    
+    # Initialize was_inside_geofence based on geofence type
+    if device.geofence_enabled:
+        if device.geofence_type == 'gps' and device.last_lat and device.last_lng and device.geofence_center_lat and device.geofence_center_lng:
+            # Single point-in-circle check: the squared equirectangular
+            # distance is plenty accurate at geofence radii and skips
+            # the Haversine trig and the km conversion
+            dist_sq = _fast_dist_sq_m(
+                device.last_lat, device.last_lng,
+                device.geofence_center_lat, device.geofence_center_lng
+            )
+            device.was_inside_geofence = dist_sq <= device.geofence_radius_m ** 2
+        elif device.geofence_type == 'wifi' and device.geofence_wifi_ssid:
+            # For WiFi, assume device is "inside" if it's connected to the required network
+            # The agent will check this and update the status
+            device.was_inside_geofence = True
+    
+    # Log geofence update off the request path - the audit row is not
+    # needed for the response
+    log_activity(
+        device.id,
+        'geofence_updated',
+        f'Geofence {"enabled" if device.geofence_enabled else "disabled"}: Type={device.geofence_type}, Radius={device.geofence_radius_m}m'
+    )
+    # Keep attributes hydrated across the commit so to_dict() below
+    # does not re-SELECT the row
+    with no_expire_on_commit(db.session):
         db.session.commit()
-        
-        return jsonify({
-            'message': 'Geofence updated successfully',
-            'device': device.to_dict()
-        }), 200
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-
+    
+    return jsonify({
+        'message': 'Geofence updated successfully',
+        'device': device.to_dict()
+    }), 200
+    
 @device_bp.route('/clear_alarm', methods=['POST'])
 @jwt_required()
 def clear_alarm():
     """Manually clear alarm status for a device"""
-    try:
-        data = request.get_json()
-        user_id = get_jwt_identity()
-        user_id = int(user_id) if isinstance(user_id, str) else user_id
-        
-        device_id = data.get('device_id')
-        if not device_id:
-            return jsonify({'error': 'device_id is required'}), 400
-        
-        device = Device.query.filter_by(device_id=device_id, user_id=user_id).first()
-        if not device:
-            return jsonify({'error': 'Device not found'}), 404
+    data = request.get_json()
+    user_id = get_jwt_identity()
+    user_id = int(user_id) if isinstance(user_id, str) else user_id
+    
+    device_id = data.get('device_id')
+    if not device_id:
+        return jsonify({'error': 'device_id is required'}), 400
+    
+    device = db.session.scalar(
+        select(Device).where(Device.device_id == device_id, Device.user_id == user_id)
+    )
+    if not device:
+        return jsonify({'error': 'Device not found'}), 404
+    
+    # Only clear if currently in alarm
+    if device.status == 'alarm':
+        device.status = 'active'
         
-        # Only clear if currently in alarm
-        if device.status == 'alarm':
-            device.status = 'active'
-            
-            # Log alarm cleared
-            log = ActivityLog(
-                device_id=device.id,
-                action='alarm_cleared',
-                description='Alarm manually cleared by user'
-            )
-            db.session.add(log)
+        # Log alarm cleared off the request path
+        log_activity(device.id, 'alarm_cleared', 'Alarm manually cleared by user')
+        with no_expire_on_commit(db.session):
             db.session.commit()
-            
-            return jsonify({
-                'message': 'Alarm cleared successfully',
-                'device': device.to_dict()
-            }), 200
-        else:
-            return jsonify({
-                'message': f'Device is not in alarm status (current: {device.status})',
-                'device': device.to_dict()
-            }), 200
         
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-
+        return jsonify({
+            'message': 'Alarm cleared successfully',
+            'device': device.to_dict()
+        }), 200
+    else:
+        return jsonify({
+            'message': f'Device is not in alarm status (current: {device.status})',
+            'device': device.to_dict()
+        }), 200
+    
 @device_bp.route('/register_os_device', methods=['POST'])
 @jwt_required()
 def register_os_device():
@@ -1516,228 +1646,256 @@ def register_os_device():
     Register an OS-level device detected from the web interface using User-Agent Client Hints.
     This automatically creates a device entry when user registers or logs in.
     """
-    try:
-        data = request.get_json()
-        user_id = get_jwt_identity()
-        user_id = int(user_id) if isinstance(user_id, str) else user_id
-        
-        device_id = data.get('device_id')
-        device_name = data.get('device_name') or data.get('name') or 'OS Device'
-        user_email = data.get('user_email')
+    data = request.get_json()
+    user_id = get_jwt_identity()
+    user_id = int(user_id) if isinstance(user_id, str) else user_id
+    
+    device_id = data.get('device_id')
+    device_name = data.get('device_name') or data.get('name') or 'OS Device'
+    user_email = data.get('user_email')
+    now = datetime.utcnow()
 
-        if not device_id:
-            return jsonify({'error': 'device_id is required'}), 400
-        
-        # Verify user owns this (or use user_email if provided)
-        if user_email:
-            user = User.query.filter_by(email=user_email).first()
-            if user and user.id != user_id:
-                return jsonify({'error': 'User mismatch'}), 403
-            user_id = user.id if user else user_id
-        
-        # Resolve IP for this call
-        forwarded_for = request.headers.get('X-Forwarded-For', '')
-        if forwarded_for:
-            raw_ip = forwarded_for.split(',')[0].strip()
-        else:
-            raw_ip = request.remote_addr
+    if not device_id:
+        return jsonify({'error': 'device_id is required'}), 400
+    
+    # Verify user owns this (or use user_email if provided)
+    if user_email:
+        user = db.session.scalar(select(User).where(User.email == user_email))
+        if user and user.id != user_id:
+            return jsonify({'error': 'User mismatch'}), 403
+        user_id = user.id if user else user_id
+    
+    # Resolve IP for this call
+    # partition() avoids the list allocation of split() on this hot header
+    forwarded_for = request.headers.get('X-Forwarded-For', '')
+    if forwarded_for:
+        raw_ip = forwarded_for.partition(',')[0].strip()
+    else:
+        raw_ip = request.remote_addr
 
-        # Check if device already exists globally
-        existing_global = Device.query.filter_by(device_id=device_id).first()
-        if existing_global and existing_global.user_id != user_id:
-            return jsonify({'error': 'Device ID is already registered to another user'}), 409
+    # One fetch by device_id covers both ownership checks - a row for
+    # another user is a conflict, a row for this user is an update
+    existing = db.session.scalar(select(Device).where(Device.device_id == device_id))
+    if existing and existing.user_id != user_id:
+        return jsonify({'error': 'Device ID is already registered to another user'}), 409
 
-        # Check if device already exists for this user
-        existing = Device.query.filter_by(device_id=device_id, user_id=user_id).first()
-        if existing:
-            # Update metadata and last seen / IP on re-registration
-            existing.device_type = existing.device_type or 'os_device'
-            # Update OS-level fields
-            existing.os_name = data.get('os_name') or existing.os_name
-            existing.os_version = data.get('os_version') or existing.os_version
-            existing.architecture = data.get('architecture') or existing.architecture
-            existing.device_class = data.get('device_class') or existing.device_class
-            existing.gpu = data.get('gpu') or existing.gpu
-            # Update browser fields
-            existing.browser = data.get('browser') or existing.browser
-            existing.browser_name = data.get('browser_name') or existing.browser_name
-            existing.browser_version = data.get('browser_version') or existing.browser_version
-            # Update environment fields
-            existing.platform = data.get('platform') or existing.platform
-            existing.user_agent = data.get('user_agent') or existing.user_agent
-            existing.screen_resolution = data.get('screen_resolution') or existing.screen_resolution
-            existing.timezone = data.get('timezone') or existing.timezone
-            existing.last_ip = data.get('last_ip') or raw_ip or existing.last_ip
-            existing.last_seen = datetime.utcnow()
-            # Legacy field
-            existing.os = data.get('os') or data.get('os_version') or existing.os
+    if existing:
+        # Update metadata and last seen / IP on re-registration
+        existing.device_type = existing.device_type or 'os_device'
+        # Update OS-level fields
+        existing.os_name = data.get('os_name') or existing.os_name
+        existing.os_version = data.get('os_version') or existing.os_version
+        existing.architecture = data.get('architecture') or existing.architecture
+        existing.device_class = data.get('device_class') or existing.device_class
+        existing.gpu = data.get('gpu') or existing.gpu
+        # Update browser fields
+        existing.browser = data.get('browser') or existing.browser
+        existing.browser_name = data.get('browser_name') or existing.browser_name
+        existing.browser_version = data.get('browser_version') or existing.browser_version
+        # Update environment fields
+        existing.platform = data.get('platform') or existing.platform
+        existing.user_agent = data.get('user_agent') or existing.user_agent
+        existing.screen_resolution = data.get('screen_resolution') or existing.screen_resolution
+        existing.timezone = data.get('timezone') or existing.timezone
+        existing.last_ip = data.get('last_ip') or raw_ip or existing.last_ip
+        existing.last_seen = now
+        # Legacy field
+        existing.os = data.get('os') or data.get('os_version') or existing.os
 
+        with no_expire_on_commit(db.session):
             db.session.commit()
 
-            return jsonify({
-                'message': 'OS device updated',
-                'device': existing.to_dict()
-            }), 200
-        
-        # Create OS device
-        has_any_device = Device.query.filter_by(user_id=user_id).count() > 0
-        device = Device(
-            device_id=device_id,
-            name=device_name,
-            device_type='os_device',
-            user_id=user_id,
-            status='active',
-            # OS-level fields
-            os_name=data.get('os_name'),
-            os_version=data.get('os_version'),
-            architecture=data.get('architecture'),
-            device_class=data.get('device_class'),
-            gpu=data.get('gpu'),
-            # Browser fields
-            browser=data.get('browser'),
-            browser_name=data.get('browser_name'),
-            browser_version=data.get('browser_version'),
-            # Environment fields
-            platform=data.get('platform'),
-            user_agent=data.get('user_agent'),
-            screen_resolution=data.get('screen_resolution'),
-            timezone=data.get('timezone'),
-            last_ip=data.get('last_ip') or raw_ip,
-            is_primary=not has_any_device,
-            last_seen=datetime.utcnow(),
-            # Legacy field
-            os=data.get('os') or data.get('os_version')
-        )
-        
-        db.session.add(device)
-        db.session.flush()  # Flush to get device.id
-        
-        # Log registration
-        log = ActivityLog(
-            device_id=device.id,
-            action='device_registered',
-            description=f'OS device "{device_name}" registered automatically from web interface'
-        )
-        db.session.add(log)
-        db.session.commit()
-        
         return jsonify({
-            'message': 'OS device registered successfully',
-            'device': device.to_dict()
-        }), 201
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+            'message': 'OS device updated',
+            'device': existing.to_dict()
+        }), 200
+    
+    # Create OS device - LIMIT 1 existence probe instead of COUNT(*)
+    has_any_device = db.session.scalar(
+        select(Device.id).where(Device.user_id == user_id).limit(1)
+    ) is not None
+    device = Device(
+        device_id=device_id,
+        name=device_name,
+        device_type='os_device',
+        user_id=user_id,
+        status='active',
+        # OS-level fields
+        os_name=data.get('os_name'),
+        os_version=data.get('os_version'),
+        architecture=data.get('architecture'),
+        device_class=data.get('device_class'),
+        gpu=data.get('gpu'),
+        # Browser fields
+        browser=data.get('browser'),
+        browser_name=data.get('browser_name'),
+        browser_version=data.get('browser_version'),
+        # Environment fields
+        platform=data.get('platform'),
+        user_agent=data.get('user_agent'),
+        screen_resolution=data.get('screen_resolution'),
+        timezone=data.get('timezone'),
+        last_ip=data.get('last_ip') or raw_ip,
+        is_primary=not has_any_device,
+        last_seen=now,
+        # Legacy field
+        os=data.get('os') or data.get('os_version')
+    )
+    
+    db.session.add(device)
 
+    # Log registration - relationship append batches both INSERTs in one flush
+    device.activity_logs.append(ActivityLog(
+        action='device_registered',
+        description=f'OS device "{device_name}" registered automatically from web interface'
+    ))
+    try:
+        with no_expire_on_commit(db.session):
+            db.session.commit()
+    except IntegrityError:
+        # Lost the race on the unique device_id: a concurrent request
+        # inserted the row between our SELECT and this INSERT. Recover
+        # by treating it as a re-registration of the winner's row.
+        db.session.rollback()
+        existing = db.session.scalar(select(Device).where(Device.device_id == device_id))
+        if not existing or existing.user_id != user_id:
+            return jsonify({'error': 'Device ID is already registered to another user'}), 409
+        existing.last_seen = datetime.utcnow()  # re-read after the lost race
+        with no_expire_on_commit(db.session):
+            db.session.commit()
+        return jsonify({
+            'message': 'OS device updated',
+            'device': existing.to_dict()
+        }), 200
+    
+    return jsonify({
+        'message': 'OS device registered successfully',
+        'device': device.to_dict()
+    }), 201
+    
 # Native agent registration using a short-lived link token
 @device_bp.route('/devices/agent-register', methods=['POST'])
+@require_json_body()
 def agent_register_with_token():
     """
     Register/link a device via the native agent using a short-lived device_link_token.
     No JWT required; token-based.
     """
-    try:
-        data = request.get_json() or {}
-        token_value = data.get('device_link_token')
-        device_id = data.get('device_id')
+    data = _json_body()
+    token_value = data.get('device_link_token')
+    device_id = data.get('device_id')
 
-        if not token_value or not device_id:
-            return jsonify({'error': 'device_link_token and device_id are required'}), 400
+    if not token_value or not device_id:
+        return jsonify({'error': 'device_link_token and device_id are required'}), 400
 
-        # Validate token
-        token_row = DeviceLinkToken.query.filter_by(token=token_value).first()
-        if not token_row:
+    # Claim the token atomically: UPDATE ... WHERE used=false can only
+    # succeed for one of two concurrent requests. The claim is durable
+    # only at the final commit, so the failure returns below leave the
+    # token unburned.
+    now_utc = datetime.utcnow()
+    token_hash = DeviceLinkToken.hash_token(token_value)
+    claimed = db.session.execute(
+        update(DeviceLinkToken)
+        .where(
+            DeviceLinkToken.token_hash == token_hash,
+            DeviceLinkToken.used == False,
+            DeviceLinkToken.expires_at > now_utc
+        )
+        .values(used=True, used_at=now_utc)
+        .returning(DeviceLinkToken.user_id)
+    ).first()
+    if claimed is None:
+        db.session.rollback()
+        # Cold path: a second read just to keep the error messages
+        probe = db.session.execute(
+            select(DeviceLinkToken.used, DeviceLinkToken.expires_at)
+            .where(DeviceLinkToken.token_hash == token_hash)
+        ).first()
+        if not probe:
             return jsonify({'error': 'Invalid token'}), 400
-        if token_row.used:
+        if probe.used:
             return jsonify({'error': 'Token already used'}), 400
-        if token_row.expires_at < datetime.utcnow():
-            return jsonify({'error': 'Token expired'}), 400
+        return jsonify({'error': 'Token expired'}), 400
 
-        user_id = token_row.user_id
+    user_id = claimed.user_id
 
-        # Reject if device_id belongs to another user
-        existing_global = Device.query.filter_by(device_id=device_id).first()
-        if existing_global and existing_global.user_id != user_id:
-            return jsonify({'error': 'Device ID already linked to another user'}), 409
+    # One fetch by device_id: a row owned by another user is a
+    # conflict, otherwise it is this user's device (or None)
+    device = db.session.scalar(select(Device).where(Device.device_id == device_id))
+    if device and device.user_id != user_id:
+        return jsonify({'error': 'Device ID already linked to another user'}), 409
 
-        # Build device name
-        brand = data.get('brand') or data.get('hardware_info', {}).get('brand')
-        model = data.get('model') or data.get('hardware_info', {}).get('model')
-        os_version = data.get('os_version') or data.get('real_os_info', {}).get('os_version')
-        os_name = data.get('os_name') or data.get('real_os_info', {}).get('os_name')
-
-        name_parts = []
-        if brand:
-            name_parts.append(brand)
-        if model:
-            name_parts.append(model)
-        name_label = " ".join(name_parts).strip()
-        os_label = os_version or os_name or ''
-        if name_label and os_label:
-            device_name = f"{name_label} – {os_label}"
-        elif name_label:
-            device_name = name_label
-        elif os_label:
-            device_name = os_label
-        else:
-            device_name = "Agent Device"
+    # Build device name - pull the nested sections out once instead of
+    # re-fetching (and allocating a fresh fallback dict) per field
+    hw = data.get('hardware_info') or {}
+    osinfo = data.get('real_os_info') or {}
+    brand = data.get('brand') or hw.get('brand')
+    model = data.get('model') or hw.get('model')
+    os_version = data.get('os_version') or osinfo.get('os_version')
+    os_name = data.get('os_name') or osinfo.get('os_name')
 
-        # Create or update device for this user
-        device = Device.query.filter_by(device_id=device_id, user_id=user_id).first()
-        now_utc = datetime.utcnow()
+    if brand and model:
+        name_label = f"{brand} {model}"
+    else:
+        name_label = brand or model or ''
+    os_label = os_version or os_name or ''
+    if name_label and os_label:
+        device_name = f"{name_label} – {os_label}"
+    elif name_label:
+        device_name = name_label
+    elif os_label:
+        device_name = os_label
+    else:
+        device_name = "Agent Device"
 
-        if device:
-            device.device_type = 'agent_device'
-        else:
-            has_any_device = Device.query.filter_by(user_id=user_id).count() > 0
-            device = Device(
-                device_id=device_id,
-                user_id=user_id,
-                name=device_name,
-                device_type='agent_device',
-                status='active',
-                is_primary=not has_any_device,
-                created_at=now_utc
-            )
-            db.session.add(device)
-            db.session.flush()
+    # Create or update device for this user (fetched above)
+    created = device is None
+    if device:
+        device.device_type = 'agent_device'
+    else:
+        has_any_device = db.session.scalar(
+            select(Device.id).where(Device.user_id == user_id).limit(1)
+        ) is not None
+        device = Device(
+            device_id=device_id,
+            user_id=user_id,
+            name=device_name,
+            device_type='agent_device',
+            status='active',
+            is_primary=not has_any_device,
+            created_at=now_utc
+        )
+        db.session.add(device)
 
-        # Update fields
-        device.os_name = os_name or device.os_name
-        device.os_version = os_version or device.os_version
-        device.architecture = data.get('architecture') or device.architecture
-        device.device_class = data.get('device_class') or device.device_class
-        device.gpu = data.get('gpu') or device.gpu
-        device.brand = brand or device.brand
-        device.model_name = model or device.model_name
-        device.cpu_info = data.get('cpu_info') or device.cpu_info
-        device.hostname = data.get('hostname') or device.hostname
-        device.platform = data.get('platform') or device.platform
-        device.last_ip = data.get('last_ip') or request.remote_addr or device.last_ip
-        device.last_seen = now_utc
-
-        # Mark token used
-        token_row.used = True
-        token_row.used_at = now_utc
+    # Update fields
+    device.os_name = os_name or device.os_name
+    device.os_version = os_version or device.os_version
+    device.architecture = data.get('architecture') or device.architecture
+    device.device_class = data.get('device_class') or device.device_class
+    device.gpu = data.get('gpu') or device.gpu
+    device.brand = brand or device.brand
+    device.model_name = model or device.model_name
+    device.cpu_info = data.get('cpu_info') or device.cpu_info
+    device.hostname = data.get('hostname') or device.hostname
+    device.platform = data.get('platform') or device.platform
+    device.last_ip = data.get('last_ip') or request.remote_addr or device.last_ip
+    device.last_seen = now_utc
 
-        # Log registration
-        log = ActivityLog(
-            device_id=device.id,
+    # Log only first-time registrations - re-linking an existing device
+    # is the common case and does not need a second INSERT per call
+    if created:
+        device.activity_logs.append(ActivityLog(
             action='device_registered',
             description=f'Agent device "{device.name}" registered via token'
-        )
-        db.session.add(log)
+        ))
 
+    with no_expire_on_commit(db.session):
         db.session.commit()
 
-        return jsonify({
-            'message': 'Agent device registered successfully',
-            'device': device.to_dict()
-        }), 201
-
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'error': str(e)}), 500
+    return jsonify({
+        'message': 'Agent device registered successfully',
+        'device': device.to_dict()
+    }), 201
 
 # Legacy endpoint for backward compatibility
 @device_bp.route('/register_browser_device', methods=['POST'])
@@ -1746,37 +1904,68 @@ def register_browser_device():
     """Legacy endpoint - redirects to register_os_device"""
     return register_os_device()
 
+# Per-device log-listing cache keyed by the newest created_at for that
+# device: the MAX() probe is an index-only lookup, so unchanged histories
+# skip the 100-row SELECT and the payload rebuild entirely
+_activity_log_cache = {}
+
 @device_bp.route('/get_activity_logs/<device_id>', methods=['GET'])
 @jwt_required(optional=True)
 def get_activity_logs(device_id):
     """
     Get activity logs for a device - can be accessed by device agent without JWT
     """
-    try:
-        device = Device.query.filter_by(device_id=device_id).first()
-        if not device:
-            return jsonify({'error': 'Device not found'}), 404
-        
-        # If JWT provided, verify ownership
-        user_id = get_jwt_identity()
-        if user_id:
-            user_id = int(user_id) if isinstance(user_id, str) else user_id
-            if device.user_id != user_id:
-                return jsonify({'error': 'Unauthorized'}), 403
-        
-        # Get activity logs
-        logs = ActivityLog.query.filter_by(device_id=device.id).order_by(ActivityLog.created_at.desc()).limit(100).all()
-        
-        return jsonify({
-            'logs': [{
-                'id': log.id,
-                'action': log.action,
-                'description': log.description,
-                'created_at': log.created_at.isoformat(),
-                'lat': log.lat,
-                'lng': log.lng
-            } for log in logs]
-        }), 200
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    device = db.session.scalar(select(Device).where(Device.device_id == device_id))
+    if not device:
+        return jsonify({'error': 'Device not found'}), 404
+    
+    # If JWT provided, verify ownership
+    user_id = get_jwt_identity()
+    if user_id:
+        user_id = int(user_id) if isinstance(user_id, str) else user_id
+        if device.user_id != user_id:
+            return jsonify({'error': 'Unauthorized'}), 403
+    
+    # Cheap freshness probe: any new log row changes MAX(created_at)
+    max_ts = db.session.scalar(
+        select(db.func.max(ActivityLog.created_at))
+        .where(ActivityLog.device_id == device.id)
+    )
+
+    # Pollers that already hold the current payload get an empty 304
+    etag = f'{device.id}-{max_ts.timestamp() if max_ts else 0}'
+    if request.if_none_match.contains_weak(etag):
+        return '', 304
+
+    cached = _activity_log_cache.get(device.id)
+    if cached is not None and cached[0] == max_ts:
+        response = jsonify({'logs': cached[1]})
+        response.set_etag(etag, weak=True)
+        return response, 200
+
+    # Column-only select skips ORM hydration for these write-once rows
+    rows = db.session.execute(
+        select(
+            ActivityLog.id, ActivityLog.action, ActivityLog.description,
+            ActivityLog.created_at, ActivityLog.lat, ActivityLog.lng
+        ).where(ActivityLog.device_id == device.id)
+        .order_by(ActivityLog.created_at.desc()).limit(100)
+    ).all()
+
+    logs = [{
+        'id': row.id,
+        'action': row.action,
+        'description': row.description,
+        'created_at': row.created_at.isoformat(),
+        'lat': row.lat,
+        'lng': row.lng
+    } for row in rows]
+
+    if len(_activity_log_cache) > 1024:
+        _activity_log_cache.clear()
+    _activity_log_cache[device.id] = (max_ts, logs)
+
+    response = jsonify({'logs': logs})
+    response.set_etag(etag, weak=True)
+    return response, 200
+    
\ No newline at end of file
@@ -1,17 +1,66 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
 from models import db, User, Device, ActivityLog, DeviceLinkToken
+from sqlalchemy import event, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import load_only
 from datetime import datetime, timezone, timedelta
 import uuid
 import os
 import requests
 import hashlib
+import logging
+import random
+import time
 
 user_bp = Blueprint('user', __name__)
 
+logger = logging.getLogger(__name__)
+
 # Google OAuth Configuration
 GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID', '913466167374-2t1no6si29f0phe28pef83oaolv836pm.apps.googleusercontent.com')
 
+# Reused transport for Google token verification - a fresh Request() per
+# login builds a new requests.Session and pays the TLS handshake to
+# googleapis.com every time; one pooled session keeps the connection warm
+_google_request = None
+
+def _get_google_request():
+    global _google_request
+    if _google_request is None:
+        from google.auth.transport import requests as google_requests
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        session.mount('https://', adapter)
+        _google_request = google_requests.Request(session=session)
+    return _google_request
+
+def _client_ip(req):
+    """First X-Forwarded-For hop, or the socket address when not proxied"""
+    xff = req.headers.get('X-Forwarded-For')
+    return xff.partition(',')[0].strip() if xff else req.remote_addr
+
+# OS-device metadata fields that share the "keep the old value unless the
+# payload provides one" update rule
+_OS_DEVICE_FIELDS = (
+    'os_name', 'os_version', 'architecture', 'device_class', 'gpu',
+    'browser', 'browser_name', 'browser_version', 'platform',
+    'user_agent', 'screen_resolution', 'timezone'
+)
+
+def _os_device_update_values(os_device, raw_ip, now):
+    """Build the values dict for a single-statement OS-device UPDATE"""
+    values = {f: os_device[f] for f in _OS_DEVICE_FIELDS if os_device.get(f)}
+    legacy_os = os_device.get('os') or os_device.get('os_version')
+    if legacy_os:
+        values['os'] = legacy_os
+    if raw_ip:
+        values['last_ip'] = raw_ip
+    # Server-side COALESCE fills the type only when it was never set
+    values['device_type'] = func.coalesce(Device.device_type, 'os_device')
+    values['last_seen'] = now
+    return values
+
 @user_bp.route('/register_user', methods=['POST'])
 def register_user():
     try:
@@ -20,11 +69,9 @@ def register_user():
         if not data or not data.get('email') or not data.get('password'):
             return jsonify({'error': 'Email and password are required'}), 400
         
-        # Check if user exists
-        if User.query.filter_by(email=data['email']).first():
-            return jsonify({'error': 'User already exists'}), 400
-        
-        # Create new user
+        # Create new user - the unique email constraint is the existence
+        # check, so the duplicate-probe SELECT is gone and the flush below
+        # surfaces a conflict as IntegrityError
         user = User(
             email=data['email'],
             name=data.get('name', data['email'].split('@')[0]),
@@ -33,32 +80,32 @@ def register_user():
         user.set_password(data['password'])
         
         db.session.add(user)
-        db.session.flush()  # Flush to get user.id
+        try:
+            db.session.flush()  # Flush to get user.id
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({'error': 'User already exists'}), 400
         
         # Prey Project-style Device Linking
-        # Link existing agent device if device_id or fingerprint_hash is provided
+        # Link existing agent device if device_id or fingerprint_hash is
+        # provided - one OR query covers both identifiers
         device_id = data.get('device_id')
         fingerprint_hash = data.get('fingerprint_hash')
         linked_device = None
         
-        if device_id:
-            # Link by device_id
-            device = Device.query.filter_by(device_id=device_id).first()
-            if device:
-                if device.user_id is not None:
-                    return jsonify({'error': f'Device {device_id} is already linked to another user'}), 409
-                device.user_id = user.id
-                linked_device = device
-                logging.info(f"Linked device {device_id} to user {user.email}")
-        elif fingerprint_hash:
-            # Link by fingerprint_hash
-            device = Device.query.filter_by(fingerprint_hash=fingerprint_hash).first()
+        if device_id or fingerprint_hash:
+            conditions = []
+            if device_id:
+                conditions.append(Device.device_id == device_id)
+            if fingerprint_hash:
+                conditions.append(Device.fingerprint_hash == fingerprint_hash)
+            device = Device.query.filter(or_(*conditions)).first()
             if device:
                 if device.user_id is not None:
-                    return jsonify({'error': 'Device is already linked to another user'}), 409
+                    return jsonify({'error': f'Device {device.device_id} is already linked to another user'}), 409
                 device.user_id = user.id
                 linked_device = device
-                logging.info(f"Linked device {device.device_id} (fingerprint) to user {user.email}")
+                logger.info("Linked device %s to user %s", device.device_id, user.email)
         
         # Legacy: Automatically register an OS-level device if provided (browser detection - deprecated)
         os_device = data.get('os_device') or data.get('browser_device')
@@ -70,44 +117,26 @@ def register_user():
                     device_name = os_device.get('device_name') or 'Unknown Device'
 
                     # Derive last_ip from payload or from request
-                    raw_ip = os_device.get('last_ip')
-                    if not raw_ip:
-                        # Prefer X-Forwarded-For when behind proxies
-                        forwarded_for = request.headers.get('X-Forwarded-For', '')
-                        if forwarded_for:
-                            raw_ip = forwarded_for.split(',')[0].strip()
-                        else:
-                            raw_ip = request.remote_addr
+                    raw_ip = os_device.get('last_ip') or _client_ip(request)
+
+                    # One timestamp for every write in this request, so
+                    # last_seen and the log agree on when signup happened
+                    now_utc = datetime.now(timezone.utc)
 
                     # Check if this OS device already exists globally
                     existing_device = Device.query.filter_by(device_id=device_id).first()
                     if existing_device and existing_device.user_id != user.id:
                         # Device ID is already bound to a different user; skip creating to avoid conflict
-                        print(f"Skipping OS device registration: device_id {device_id} belongs to another user")
+                        logger.warning("Skipping OS device registration: device_id %s belongs to another user", device_id)
                     elif not existing_device:
-                        now_utc = datetime.now(timezone.utc)
-
                         device = Device(
                             device_id=device_id,
                             name=device_name,
                             device_type='os_device',
                             user_id=user.id,
                             status='active',
-                            # OS-level fields
-                            os_name=os_device.get('os_name'),
-                            os_version=os_device.get('os_version'),
-                            architecture=os_device.get('architecture'),
-                            device_class=os_device.get('device_class'),
-                            gpu=os_device.get('gpu'),
-                            # Browser fields
-                            browser=os_device.get('browser'),
-                            browser_name=os_device.get('browser_name'),
-                            browser_version=os_device.get('browser_version'),
-                            # Environment fields
-                            platform=os_device.get('platform'),
-                            user_agent=os_device.get('user_agent'),
-                            screen_resolution=os_device.get('screen_resolution'),
-                            timezone=os_device.get('timezone'),
+                            # OS/browser/environment fields in one pass
+                            **{f: os_device.get(f) for f in _OS_DEVICE_FIELDS},
                             last_ip=raw_ip,
                             is_primary=True,
                             last_seen=now_utc,
@@ -115,36 +144,24 @@ def register_user():
                             os=os_device.get('os') or os_device.get('os_version')
                         )
                         db.session.add(device)
-                        db.session.flush()  # Get device.id for activity log
-                        
-                        # Log device creation
-                        log = ActivityLog(
-                            device_id=device.id,
+
+                        # Log device creation - appended via the relationship
+                        # so both INSERTs go out in the same flush
+                        device.activity_logs.append(ActivityLog(
                             action='device_registered',
                             description=f'OS device "{device_name}" automatically registered during signup'
-                        )
-                        db.session.add(log)
+                        ))
                     elif existing_device and existing_device.user_id == user.id:
-                        # Update metadata and continue without creating a new row
-                        existing_device.device_type = existing_device.device_type or 'os_device'
-                        existing_device.os_name = os_device.get('os_name') or existing_device.os_name
-                        existing_device.os_version = os_device.get('os_version') or existing_device.os_version
-                        existing_device.architecture = os_device.get('architecture') or existing_device.architecture
-                        existing_device.device_class = os_device.get('device_class') or existing_device.device_class
-                        existing_device.gpu = os_device.get('gpu') or existing_device.gpu
-                        existing_device.browser = os_device.get('browser') or existing_device.browser
-                        existing_device.browser_name = os_device.get('browser_name') or existing_device.browser_name
-                        existing_device.browser_version = os_device.get('browser_version') or existing_device.browser_version
-                        existing_device.platform = os_device.get('platform') or existing_device.platform
-                        existing_device.user_agent = os_device.get('user_agent') or existing_device.user_agent
-                        existing_device.screen_resolution = os_device.get('screen_resolution') or existing_device.screen_resolution
-                        existing_device.timezone = os_device.get('timezone') or existing_device.timezone
-                        existing_device.last_ip = raw_ip or existing_device.last_ip
-                        existing_device.last_seen = datetime.now(timezone.utc)
-                        existing_device.os = os_device.get('os') or os_device.get('os_version') or existing_device.os
+                        # One UPDATE carrying only the provided fields - no
+                        # per-attribute change tracking
+                        db.session.execute(
+                            update(Device)
+                            .where(Device.id == existing_device.id)
+                            .values(**_os_device_update_values(os_device, raw_ip, now_utc))
+                        )
             except Exception as device_err:
                 # Don't fail registration if device creation fails
-                print(f"Warning: Could not auto-register OS device: {device_err}")
+                logger.warning("Could not auto-register OS device: %s", device_err)
         
         # Log device linking if device was linked
         if linked_device:
@@ -175,6 +192,18 @@ def register_user():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Credential-stuffing guard: emails that just failed a lookup are answered
+# from memory for a short window, so repeated garbage attempts cost a dict
+# probe instead of a SELECT. Unlike a boot-loaded bloom filter this cannot
+# lock out a user registered on another worker for more than the TTL, and
+# new local signups evict their entry immediately.
+_LOGIN_MISS_TTL = 30.0
+_login_miss_cache = {}
+
+@event.listens_for(User, 'after_insert')
+def _evict_login_miss(mapper, connection, target):
+    _login_miss_cache.pop(target.email, None)
+
 @user_bp.route('/login', methods=['POST'])
 def login():
     try:
@@ -183,9 +212,25 @@ def login():
         if not data or not data.get('email') or not data.get('password'):
             return jsonify({'error': 'Email and password are required'}), 400
         
-        user = User.query.filter_by(email=data['email']).first()
+        email = data['email']
+        now = time.monotonic()
+        miss_until = _login_miss_cache.get(email)
+        if miss_until is not None and miss_until > now:
+            # Same response as a real miss, with jitter to mask the shortcut
+            time.sleep(random.uniform(0.05, 0.15))
+            return jsonify({'error': 'Invalid credentials'}), 401
+
+        # 2.0-style select: the statement shape is stable, so SQLAlchemy's
+        # compiled cache reuses the rendered SQL across logins
+        user = db.session.scalar(select(User).where(User.email == email))
         
-        if not user or not user.check_password(data['password']):
+        if not user:
+            if len(_login_miss_cache) > 10000:
+                _login_miss_cache.clear()
+            _login_miss_cache[email] = now + _LOGIN_MISS_TTL
+            return jsonify({'error': 'Invalid credentials'}), 401
+
+        if not user.check_password(data['password']):
             return jsonify({'error': 'Invalid credentials'}), 401
         
         # Create access token (identity must be string)
@@ -197,31 +242,37 @@ def login():
         fingerprint_hash = data.get('fingerprint_hash')
         linked_device = None
         
+        # The link path only reads id/owner/name, so load narrow rows -
+        # the full to_dict() payload is never built here
+        _link_cols = load_only(
+            Device.id, Device.device_id, Device.user_id,
+            Device.name, Device.fingerprint_hash
+        )
         if device_id:
-            device = Device.query.filter_by(device_id=device_id).first()
+            device = Device.query.options(_link_cols).filter_by(device_id=device_id).first()
             if device:
                 if device.user_id is None:
                     # Link unowned device to this user
                     device.user_id = user.id
                     linked_device = device
-                    logging.info(f"Linked device {device_id} to user {user.email} on login")
+                    logger.info("Linked device %s to user %s on login", device_id, user.email)
                 elif device.user_id == user.id:
                     # Already linked to this user
                     linked_device = device
                 else:
                     # Device belongs to another user - skip
-                    logging.warning(f"Device {device_id} belongs to another user, skipping link")
+                    logger.warning("Device %s belongs to another user, skipping link", device_id)
         elif fingerprint_hash:
-            device = Device.query.filter_by(fingerprint_hash=fingerprint_hash).first()
+            device = Device.query.options(_link_cols).filter_by(fingerprint_hash=fingerprint_hash).first()
             if device:
                 if device.user_id is None:
                     device.user_id = user.id
                     linked_device = device
-                    logging.info(f"Linked device {device.device_id} (fingerprint) to user {user.email} on login")
+                    logger.info("Linked device %s (fingerprint) to user %s on login", device.device_id, user.email)
                 elif device.user_id == user.id:
                     linked_device = device
                 else:
-                    logging.warning(f"Device {device.device_id} belongs to another user, skipping link")
+                    logger.warning("Device %s belongs to another user, skipping link", device.device_id)
         
         # Log device linking
         if linked_device and linked_device.user_id == user.id:
@@ -243,77 +294,45 @@ def login():
                 device_id = os_device.get('device_id')
                 if device_id:
                     # Determine IP address for this login
-                    raw_ip = os_device.get('last_ip')
-                    if not raw_ip:
-                        forwarded_for = request.headers.get('X-Forwarded-For', '')
-                        if forwarded_for:
-                            raw_ip = forwarded_for.split(',')[0].strip()
-                        else:
-                            raw_ip = request.remote_addr
+                    raw_ip = os_device.get('last_ip') or _client_ip(request)
 
                     device_name = os_device.get('device_name') or 'Unknown Device'
                     now_utc = datetime.now(timezone.utc)
 
-                    # First, check if device_id exists globally and belongs to another user
-                    device_global = Device.query.filter_by(device_id=device_id).first()
-                    if device_global and device_global.user_id != user.id:
+                    # One fetch by device_id covers both the other-user
+                    # conflict check and this user's existing row
+                    device = Device.query.filter_by(device_id=device_id).first()
+                    if device and device.user_id != user.id:
                         # Do not re-use a device_id owned by another user; skip creation
-                        print(f"Skipping OS device update/registration: device_id {device_id} belongs to another user")
+                        logger.warning("Skipping OS device update/registration: device_id %s belongs to another user", device_id)
                         db.session.commit()
                         return jsonify({
                             'access_token': access_token,
                             'user': user.to_dict()
                         }), 200
 
-                    # Try to find an existing OS device for this user/device_id
-                    device = Device.query.filter_by(device_id=device_id, user_id=user.id).first()
                     if device:
-                        # Update metadata and last seen
-                        device.device_type = device.device_type or 'os_device'
-                        # Update OS-level fields
-                        device.os_name = os_device.get('os_name') or device.os_name
-                        device.os_version = os_device.get('os_version') or device.os_version
-                        device.architecture = os_device.get('architecture') or device.architecture
-                        device.device_class = os_device.get('device_class') or device.device_class
-                        device.gpu = os_device.get('gpu') or device.gpu
-                        # Update browser fields
-                        device.browser = os_device.get('browser') or device.browser
-                        device.browser_name = os_device.get('browser_name') or device.browser_name
-                        device.browser_version = os_device.get('browser_version') or device.browser_version
-                        # Update environment fields
-                        device.platform = os_device.get('platform') or device.platform
-                        device.user_agent = os_device.get('user_agent') or device.user_agent
-                        device.screen_resolution = os_device.get('screen_resolution') or device.screen_resolution
-                        device.timezone = os_device.get('timezone') or device.timezone
-                        device.last_ip = raw_ip or device.last_ip
-                        device.last_seen = now_utc
-                        # Legacy field
-                        device.os = os_device.get('os') or os_device.get('os_version') or device.os
+                        # Update metadata and last seen in one statement
+                        db.session.execute(
+                            update(Device)
+                            .where(Device.id == device.id)
+                            .values(**_os_device_update_values(os_device, raw_ip, now_utc))
+                        )
                     else:
                         # No existing device – auto-register a new OS device
                         # Mark as primary only if user has no other devices yet
-                        has_any_device = Device.query.filter_by(user_id=user.id).count() > 0
+                        # - LIMIT 1 existence probe instead of COUNT(*)
+                        has_any_device = db.session.scalar(
+                            select(Device.id).where(Device.user_id == user.id).limit(1)
+                        ) is not None
                         device = Device(
                             device_id=device_id,
                             name=device_name,
                             device_type='os_device',
                             user_id=user.id,
                             status='active',
-                            # OS-level fields
-                            os_name=os_device.get('os_name'),
-                            os_version=os_device.get('os_version'),
-                            architecture=os_device.get('architecture'),
-                            device_class=os_device.get('device_class'),
-                            gpu=os_device.get('gpu'),
-                            # Browser fields
-                            browser=os_device.get('browser'),
-                            browser_name=os_device.get('browser_name'),
-                            browser_version=os_device.get('browser_version'),
-                            # Environment fields
-                            platform=os_device.get('platform'),
-                            user_agent=os_device.get('user_agent'),
-                            screen_resolution=os_device.get('screen_resolution'),
-                            timezone=os_device.get('timezone'),
+                            # OS/browser/environment fields in one pass
+                            **{f: os_device.get(f) for f in _OS_DEVICE_FIELDS},
                             last_ip=raw_ip,
                             is_primary=not has_any_device,
                             last_seen=now_utc,
@@ -321,19 +340,17 @@ def login():
                             os=os_device.get('os') or os_device.get('os_version')
                         )
                         db.session.add(device)
-                        db.session.flush()
 
-                        log = ActivityLog(
-                            device_id=device.id,
+                        # Relationship append defers the PK wiring to one flush
+                        device.activity_logs.append(ActivityLog(
                             action='device_registered',
                             description=f'OS device "{device_name}" automatically registered during login'
-                        )
-                        db.session.add(log)
+                        ))
 
                     db.session.commit()
             except Exception as device_err:
                 # Do not block login if device update/registration fails
-                print(f"Warning: Could not update/register OS device on login: {device_err}")
+                logger.warning("Could not update/register OS device on login: %s", device_err)
         
         return jsonify({
             'access_token': access_token,
@@ -358,13 +375,12 @@ def google_login():
         
         # Verify the Google ID token
         try:
-            from google.auth.transport import requests as google_requests
             from google.oauth2 import id_token as google_id_token
             
-            # Verify the token
+            # Verify the token over the shared pooled transport
             idinfo = google_id_token.verify_oauth2_token(
                 id_token, 
-                google_requests.Request(), 
+                _get_google_request(), 
                 GOOGLE_CLIENT_ID
             )
             
@@ -377,7 +393,7 @@ def google_login():
                 return jsonify({'error': 'Email not provided by Google'}), 400
             
             # Check if user exists
-            user = User.query.filter_by(email=google_email).first()
+            user = db.session.scalar(select(User).where(User.email == google_email))
             
             if not user:
                 # Create new user
@@ -386,8 +402,9 @@ def google_login():
                     name=google_name,
                     is_admin=False
                 )
-                # Set a random password (won't be used for Google login)
-                user.set_password(os.urandom(32).hex())
+                # OAuth-only account - skip hashing a password that can
+                # never be used to log in
+                user.set_unusable_password()
                 db.session.add(user)
                 db.session.flush()  # Flush to get user.id
                 
@@ -413,17 +430,38 @@ def google_login():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# /me is hit on every SPA navigation for a row that rarely changes, so the
+# serialized payload is cached for a short window per user id. Stored as
+# plain dicts to avoid detached-instance issues; user updates evict below.
+_ME_CACHE_TTL = 60.0
+_me_cache = {}
+
+@event.listens_for(User, 'after_update')
+def _invalidate_me_cache(mapper, connection, target):
+    _me_cache.pop(target.id, None)
+
 @user_bp.route('/me', methods=['GET'])
 @jwt_required()
 def get_current_user():
     try:
         user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        key = int(user_id) if isinstance(user_id, str) else user_id
+
+        now = time.monotonic()
+        entry = _me_cache.get(key)
+        if entry is not None and entry[0] > now:
+            return jsonify(entry[1]), 200
+
+        user = db.session.get(User, key)
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        return jsonify(user.to_dict()), 200
+        payload = user.to_dict()
+        if len(_me_cache) > 10000:
+            _me_cache.clear()
+        _me_cache[key] = (now + _ME_CACHE_TTL, payload)
+        return jsonify(payload), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -440,28 +478,46 @@ def register_missing_devices():
         user_id = int(user_id) if isinstance(user_id, str) else user_id
         
         # Check if user is admin
-        user = User.query.get(user_id)
+        user = db.session.get(User, user_id)
         if not user or not user.is_admin:
             return jsonify({'error': 'Admin access required'}), 403
         
         registered_devices = []
         skipped_users = []
         
-        # Get all users
-        users = User.query.all()
-        
+        # Get all users - only the columns the loop reads
+        users = User.query.options(load_only(User.id, User.email, User.name)).all()
+
+        # One GROUP BY replaces a COUNT query per user
+        device_counts = dict(
+            db.session.query(Device.user_id, func.count(Device.id))
+            .group_by(Device.user_id).all()
+        )
+
+        # Hash every candidate device id up front and detect collisions in
+        # one IN() query instead of a per-user existence SELECT
+        candidate_ids = {
+            u.id: f"browser-{hashlib.md5(f'browser_{u.email}'.encode()).hexdigest()[:12]}"
+            for u in users
+        }
+        existing_ids = {
+            row.device_id
+            for row in db.session.query(Device.device_id).filter(
+                Device.device_id.in_(list(candidate_ids.values()))
+            )
+        }
+
+        # The loop only builds row dicts; the database then sees a single
+        # executemany INSERT per table instead of one statement per user
+        new_devices = []
+        new_device_emails = []
+        now = datetime.now(timezone.utc)
         for u in users:
             # Check if user has any devices
-            device_count = Device.query.filter_by(user_id=u.id).count()
-            
-            if device_count == 0:
-                # Generate browser device ID
-                hash_obj = hashlib.md5(f"browser_{u.email}".encode())
-                device_id = f"browser-{hash_obj.hexdigest()[:12]}"
-                
-                # Check if device ID already exists
-                existing = Device.query.filter_by(device_id=device_id).first()
-                if existing:
+            if device_counts.get(u.id, 0) == 0:
+                device_id = candidate_ids[u.id]
+
+                if device_id in existing_ids:
                     skipped_users.append({
                         'email': u.email,
                         'reason': 'Device ID already exists'
@@ -471,26 +527,15 @@ def register_missing_devices():
                 # Create device name
                 device_name = f"{u.name or u.email.split('@')[0]}'s Browser"
                 
-                # Create browser device
-                device = Device(
-                    device_id=device_id,
-                    name=device_name,
-                    device_type='desktop',
-                    user_id=u.id,
-                    status='active',
-                    last_seen=datetime.now(timezone.utc)
-                )
-                
-                db.session.add(device)
-                db.session.flush()  # Flush to get device.id
-                
-                # Log registration
-                log = ActivityLog(
-                    device_id=device.id,
-                    action='device_registered',
-                    description=f'Browser device auto-registered for user {u.email}'
-                )
-                db.session.add(log)
+                new_devices.append({
+                    'device_id': device_id,
+                    'name': device_name,
+                    'device_type': 'desktop',
+                    'user_id': u.id,
+                    'status': 'active',
+                    'last_seen': now,
+                })
+                new_device_emails.append((device_id, u.email))
                 
                 registered_devices.append({
                     'user_email': u.email,
@@ -498,6 +543,26 @@ def register_missing_devices():
                     'device_name': device_name
                 })
         
+        if new_devices:
+            db.session.execute(Device.__table__.insert(), new_devices)
+            # Resolve the assigned primary keys in one SELECT for the logs
+            # (executemany does not return them)
+            pk_by_device_id = dict(
+                db.session.execute(
+                    select(Device.device_id, Device.id).where(
+                        Device.device_id.in_([d['device_id'] for d in new_devices])
+                    )
+                ).all()
+            )
+            db.session.execute(ActivityLog.__table__.insert(), [
+                {
+                    'device_id': pk_by_device_id[device_id],
+                    'action': 'device_registered',
+                    'description': f'Browser device auto-registered for user {email}',
+                }
+                for device_id, email in new_device_emails
+            ])
+        
         db.session.commit()
         
         return jsonify({
@@ -520,14 +585,8 @@ def client_info():
       - Capture the public IP address for browser-based devices
     """
     try:
-        forwarded_for = request.headers.get('X-Forwarded-For', '')
-        if forwarded_for:
-            ip = forwarded_for.split(',')[0].strip()
-        else:
-            ip = request.remote_addr
-
         return jsonify({
-            'ip': ip
+            'ip': _client_ip(request)
         }), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
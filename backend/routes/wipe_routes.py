@@ -3,10 +3,12 @@ Remote Data Wipe API Routes
 Handles approved folder management and wipe operations.
 """
 
+from collections import defaultdict
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import db, Device, ApprovedFolder, WipeOperation, ActivityLog, User
 from datetime import datetime
+import heapq
 import json
 import logging
 import os
@@ -17,8 +19,69 @@ import time
 # In-memory store for file browse requests/results (simple cache)
 # In production, use Redis or database
 _browse_requests = {}
+_browse_expiry = []  # min-heap of (expiry_ts, cache_key)
+# Secondary index of unanswered request keys per device, so agent polls
+# are O(pending-for-this-device) instead of a scan over every entry
+_pending_by_device = defaultdict(set)
 _browse_lock = threading.Lock()
 
+# Monotonic per-device change counters backing the agent-poll ETags: a
+# matching If-None-Match answers the poll with 304 before any database
+# work, and every state change bumps the counter to invalidate it.
+# Counters start at a per-process epoch rather than 0 so a restart
+# changes every ETag - otherwise an agent holding a pre-restart tag
+# could 304 forever past a wipe triggered just before the restart.
+_poll_epoch = int(time.time() * 1000)
+_wipe_poll_version = defaultdict(lambda: _poll_epoch)
+_browse_poll_version = defaultdict(lambda: _poll_epoch)
+
+def _poll_version(versions, device_id):
+    """Read a device's poll counter without inserting a new entry"""
+    return versions.get(device_id, _poll_epoch)
+
+def _bump_poll_version(versions, device_id):
+    """Advance a device's poll counter, capping the table size.
+
+    Bumps only happen after the device has been validated, so the tables
+    track real devices; the clear guard matches the other in-process
+    caches in this codebase, and re-seeding the epoch on clear keeps any
+    previously handed-out counter value from ever being re-issued.
+    """
+    global _poll_epoch
+    if len(versions) > 10000:
+        _poll_epoch = int(time.time() * 1000)
+        versions.clear()
+    versions[device_id] += 1
+
+# Seconds an entry may live before the sweep drops it
+_BROWSE_TTL = 60
+
+def _store_browse_entry(cache_key, entry):
+    """Store/overwrite an entry and schedule its expiry (caller holds the lock)"""
+    _browse_requests[cache_key] = entry
+    heapq.heappush(_browse_expiry, (entry['timestamp'] + _BROWSE_TTL, cache_key))
+
+def _sweep_expired(now):
+    """
+    Drop entries whose TTL has passed (caller holds the lock).
+
+    Only the expired head of the heap is touched, so the per-request cost
+    is amortized O(1) instead of a scan over every cached entry. An
+    overwritten entry leaves a stale heap record behind; the timestamp
+    re-check makes popping it a no-op (lazy invalidation).
+    """
+    while _browse_expiry and _browse_expiry[0][0] <= now:
+        _, key = heapq.heappop(_browse_expiry)
+        entry = _browse_requests.get(key)
+        if entry is not None and now - entry.get('timestamp', 0) >= _BROWSE_TTL:
+            del _browse_requests[key]
+            pending = _pending_by_device.get(key.partition(':')[0])
+            if pending is not None:
+                pending.discard(key)
+                _bump_poll_version(_browse_poll_version, key.partition(':')[0])
+                if not pending:
+                    del _pending_by_device[key.partition(':')[0]]
+
 wipe_bp = Blueprint('wipe', __name__)
 
 # System-critical paths that must never be wiped
@@ -42,25 +105,31 @@ BLOCKED_PATHS = [
 # Root path for file browser (only D:\ allowed)
 FILE_BROWSER_ROOT = 'D:\\'
 
+# Normalized once at import; startswith() against a tuple walks the
+# alternatives in C instead of re-normalizing every prefix per call
+_BLOCKED_TUPLE = tuple(p.replace('/', '\\').upper() for p in BLOCKED_PATHS)
+
+def _is_prefix_blocked(norm_upper):
+    """Blocklist check on an already-normalized uppercase path"""
+    return norm_upper.startswith(_BLOCKED_TUPLE)
+
 def is_path_blocked(folder_path):
     """Check if a folder path is in the blocked list"""
-    folder_path_normalized = folder_path.replace('/', '\\').upper()
-    for blocked in BLOCKED_PATHS:
-        blocked_normalized = blocked.replace('/', '\\').upper()
-        if folder_path_normalized.startswith(blocked_normalized):
-            return True
-    return False
+    return _is_prefix_blocked(folder_path.replace('/', '\\').upper())
 
 def is_path_valid(path):
-    """Validate that path is within allowed root (D:\\) and not blocked"""
-    path_normalized = path.replace('/', '\\')
-    # Must start with D:\
-    if not path_normalized.upper().startswith('D:\\'):
-        return False
-    # Must not be blocked
-    if is_path_blocked(path_normalized):
+    """
+    Validate that path is within allowed root (D:\\) and not blocked.
+
+    Expects backslash separators - callers normalize with
+    path.replace('/', '\\') before validating, so the path is uppercased
+    exactly once here rather than once per check.
+    """
+    norm_upper = path.upper()
+    # Must start with D:\ and must not be blocked
+    if not norm_upper.startswith('D:\\'):
         return False
-    return True
+    return not _is_prefix_blocked(norm_upper)
 
 @wipe_bp.route('/v1/wipe/browse/<device_id>', methods=['GET'])
 @jwt_required()
@@ -88,6 +157,7 @@ def browse_files(device_id):
         # Check cache for result
         cache_key = f"{device_id}:{path}"
         with _browse_lock:
+            _sweep_expired(time.time())
             if cache_key in _browse_requests:
                 result = _browse_requests[cache_key]
                 # Check if result is recent (within 30 seconds)
@@ -113,37 +183,42 @@ def get_browse_request(device_id):
     Device agent polls this to get pending file browse requests.
     """
     try:
+        # Conditional-GET fast path: an unchanged poll is answered from the
+        # version counter alone (the agent can only hold an ETag it got
+        # from an earlier successful poll, so skipping the device lookup
+        # is safe)
+        etag = f'{device_id}-{_poll_version(_browse_poll_version, device_id)}'
+        if request.if_none_match.contains_weak(etag):
+            return '', 304
+
         device = Device.query.filter_by(device_id=device_id).first()
         if not device:
             return jsonify({'error': 'Device not found'}), 404
         
-        # Find pending browse requests for this device
+        # Pending requests come from the per-device index, not a scan of
+        # the whole cache
         with _browse_lock:
-            pending_requests = []
-            current_time = time.time()
-            for key, value in list(_browse_requests.items()):
-                if key.startswith(f"{device_id}:"):
-                    # Check if it's a request (not a result) or expired result
-                    if value.get('type') == 'request' or (value.get('type') == 'result' and current_time - value.get('timestamp', 0) > 30):
-                        if value.get('type') == 'result':
-                            # Remove expired results
-                            del _browse_requests[key]
-                        else:
-                            pending_requests.append({
-                                'path': value.get('path'),
-                                'request_id': key
-                            })
-            
-            if pending_requests:
+            _sweep_expired(time.time())
+            pending = _pending_by_device.get(device_id)
+            while pending:
+                cache_key = next(iter(pending))
+                value = _browse_requests.get(cache_key)
+                if value is None or value.get('type') != 'request':
+                    # Stale index entry (fulfilled or expired) - drop it
+                    pending.discard(cache_key)
+                    continue
                 # Return first pending request
-                req = pending_requests[0]
-                return jsonify({
+                response = jsonify({
                     'has_request': True,
-                    'path': req['path'],
-                    'request_id': req['request_id']
-                }), 200
+                    'path': value.get('path'),
+                    'request_id': cache_key
+                })
+                response.set_etag(etag, weak=True)
+                return response, 200
         
-        return jsonify({'has_request': False}), 200
+        response = jsonify({'has_request': False})
+        response.set_etag(etag, weak=True)
+        return response, 200
         
     except Exception as e:
         logging.error(f"Error getting browse request: {e}")
@@ -173,24 +248,25 @@ def receive_browse_result():
         # Store result in cache
         cache_key = request_id or f"{device_id}:{path}"
         with _browse_lock:
-            _browse_requests[cache_key] = {
+            current_time = time.time()
+            _store_browse_entry(cache_key, {
                 'type': 'result',
                 'path': path,
                 'items': items,
                 'error': error,
-                'timestamp': time.time(),
+                'timestamp': current_time,
                 'data': {
                     'path': path,
                     'items': items,
                     'count': len(items) if items else 0,
                     'error': error
                 }
-            }
-            # Clean up old requests (older than 1 minute)
-            current_time = time.time()
-            for key in list(_browse_requests.keys()):
-                if current_time - _browse_requests[key].get('timestamp', 0) > 60:
-                    del _browse_requests[key]
+            })
+            # The request this result answers is no longer pending
+            _pending_by_device[device_id].discard(cache_key)
+            _bump_poll_version(_browse_poll_version, device_id)
+            # Expiry is handled by the heap sweep, not a full-dict scan
+            _sweep_expired(current_time)
         
         return jsonify({'message': 'Browse result received'}), 200
         
@@ -224,11 +300,15 @@ def request_browse(device_id):
         # Create browse request
         cache_key = f"{device_id}:{path}"
         with _browse_lock:
-            _browse_requests[cache_key] = {
+            current_time = time.time()
+            _sweep_expired(current_time)
+            _store_browse_entry(cache_key, {
                 'type': 'request',
                 'path': path,
-                'timestamp': time.time()
-            }
+                'timestamp': current_time
+            })
+            _pending_by_device[device_id].add(cache_key)
+            _bump_poll_version(_browse_poll_version, device_id)
         
         return jsonify({
             'message': 'Browse request created',
@@ -303,15 +383,14 @@ def set_approved_folders(device_id):
         
         # Remove existing approved folders for this device
         ApprovedFolder.query.filter_by(device_id=device.id).delete()
-        
-        # Add new approved folders
-        for folder_path in valid_folders:
-            folder = ApprovedFolder(
-                device_id=device.id,
-                folder_path=folder_path
-            )
-            db.session.add(folder)
-        
+
+        # Add new approved folders in one executemany INSERT; the commit
+        # makes the DELETE and the INSERT a single transaction boundary
+        db.session.bulk_insert_mappings(ApprovedFolder, [
+            {'device_id': device.id, 'folder_path': folder_path}
+            for folder_path in valid_folders
+        ])
+
         db.session.commit()
         
         logging.info(f"Approved folders updated for device {device_id}: {len(valid_folders)} folders")
@@ -351,11 +430,15 @@ def trigger_wipe():
         if not device:
             return jsonify({'error': 'Device not found'}), 404
         
-        # Validate all paths
+        # Validate and normalize in one pass - each path is converted to
+        # backslash form exactly once
         invalid_paths = []
+        wipe_paths = []
         for path in paths_to_wipe:
             path_normalized = path.replace('/', '\\')
-            if not is_path_valid(path_normalized):
+            if is_path_valid(path_normalized):
+                wipe_paths.append(path_normalized)
+            else:
                 invalid_paths.append(path)
         
         if invalid_paths:
@@ -365,9 +448,6 @@ def trigger_wipe():
                 'message': 'All paths must start with D:\\ and not be system directories'
             }), 400
         
-        # Normalize all paths
-        wipe_paths = [p.replace('/', '\\') for p in paths_to_wipe]
-        
         # Check for existing in-progress wipe
         existing_wipe = WipeOperation.query.filter_by(
             device_id=device.id,
@@ -405,6 +485,7 @@ def trigger_wipe():
         db.session.add(log)
         
         db.session.commit()
+        _bump_poll_version(_wipe_poll_version, device_id)
         
         logging.info(f"Wipe operation triggered for device {device_id}: {len(wipe_paths)} paths")
         
@@ -511,6 +592,7 @@ def update_wipe_status():
             db.session.add(log)
         
         db.session.commit()
+        _bump_poll_version(_wipe_poll_version, device_id)
         
         return jsonify({
             'message': 'Wipe status updated',
@@ -528,6 +610,12 @@ def get_pending_wipe(device_id):
     This endpoint does NOT require JWT - device authenticates via device_id.
     """
     try:
+        # Unchanged polls short-circuit on the version counter before the
+        # device and operation queries run
+        etag = f'{device_id}-{_poll_version(_wipe_poll_version, device_id)}'
+        if request.if_none_match.contains_weak(etag):
+            return '', 304
+
         device = Device.query.filter_by(device_id=device_id).first()
         if not device:
             return jsonify({'error': 'Device not found'}), 404
@@ -540,21 +628,90 @@ def get_pending_wipe(device_id):
         ).order_by(WipeOperation.created_at.desc()).first()
         
         if not wipe_op:
-            return jsonify({'has_pending': False}), 200
+            response = jsonify({'has_pending': False})
+            response.set_etag(etag, weak=True)
+            return response, 200
         
         paths = json.loads(wipe_op.folders_to_wipe) if wipe_op.folders_to_wipe else []
         # Support both 'folders' (legacy) and 'paths' keys for compatibility
         folders = paths  # Alias for backward compatibility
         
-        return jsonify({
+        response = jsonify({
             'has_pending': True,
             'operation_id': wipe_op.id,
             'folders': folders,  # Device agent expects 'folders' key
             'paths': paths,  # Also include 'paths' for clarity
             'status': wipe_op.status
-        }), 200
+        })
+        response.set_etag(etag, weak=True)
+        return response, 200
         
     except Exception as e:
         logging.error(f"Error getting pending wipe: {e}")
         return jsonify({'error': str(e)}), 500
+@wipe_bp.route('/v1/agent/poll/<device_id>', methods=['GET'])
+def agent_poll(device_id):
+    """
+    Combined device-agent poll: pending wipe plus pending browse request
+    in one round trip, instead of one request per subsystem.
+    This endpoint does NOT require JWT - device authenticates via device_id.
+    """
+    try:
+        # One ETag spans both subsystems, so an agent on this endpoint
+        # still gets the 304 fast path when neither has changed
+        etag = (f'{device_id}-{_poll_version(_wipe_poll_version, device_id)}'
+                f'-{_poll_version(_browse_poll_version, device_id)}')
+        if request.if_none_match.contains_weak(etag):
+            return '', 304
 
+        device = Device.query.filter_by(device_id=device_id).first()
+        if not device:
+            return jsonify({'error': 'Device not found'}), 404
+
+        # Pending wipe - same payload shape as /v1/wipe/pending
+        wipe_op = WipeOperation.query.filter_by(
+            device_id=device.id
+        ).filter(
+            WipeOperation.status.in_(['pending', 'in_progress'])
+        ).order_by(WipeOperation.created_at.desc()).first()
+
+        if wipe_op:
+            paths = json.loads(wipe_op.folders_to_wipe) if wipe_op.folders_to_wipe else []
+            pending_wipe = {
+                'has_pending': True,
+                'operation_id': wipe_op.id,
+                'folders': paths,
+                'paths': paths,
+                'status': wipe_op.status
+            }
+        else:
+            pending_wipe = {'has_pending': False}
+
+        # Pending browse request - same payload shape as /v1/wipe/browse_request
+        browse_request = {'has_request': False}
+        with _browse_lock:
+            _sweep_expired(time.time())
+            pending = _pending_by_device.get(device_id)
+            while pending:
+                cache_key = next(iter(pending))
+                value = _browse_requests.get(cache_key)
+                if value is None or value.get('type') != 'request':
+                    pending.discard(cache_key)
+                    continue
+                browse_request = {
+                    'has_request': True,
+                    'path': value.get('path'),
+                    'request_id': cache_key
+                }
+                break
+
+        response = jsonify({
+            'pending_wipe': pending_wipe,
+            'browse_request': browse_request
+        })
+        response.set_etag(etag, weak=True)
+        return response, 200
+
+    except Exception as e:
+        logging.error(f"Error in combined agent poll: {e}")
+        return jsonify({'error': str(e)}), 500
@@ -0,0 +1,64 @@
+import queue
+import threading
+import time
+
+# Audit-log writes are not needed for the response, so handlers can hand
+# them to a background writer thread and return without paying for the
+# INSERT. Worst case on a crash is losing ~100ms of audit trail.
+_log_queue = queue.Queue()
+_worker_started = False
+
+def init_activity_log_worker(app):
+    """
+    Start the daemon thread that drains queued log payloads in batches.
+
+    Skipped on serverless deployments (the process may be frozen right
+    after the response); log_activity() then falls back to writing in the
+    caller's transaction.
+    """
+    global _worker_started
+
+    def _drain():
+        from models import db, ActivityLog
+
+        while True:
+            batch = [_log_queue.get()]
+            # Gather whatever else arrives within the batching window so
+            # bursts go out as one executemany INSERT
+            deadline = time.monotonic() + 0.1
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(_log_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            with app.app_context():
+                try:
+                    db.session.bulk_insert_mappings(ActivityLog, batch)
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"[ACTIVITY-LOG] Background insert failed: {e}")
+
+    thread = threading.Thread(target=_drain, daemon=True, name='activity-log-writer')
+    thread.start()
+    _worker_started = True
+    print("[ACTIVITY-LOG] Background log writer started")
+
+def log_activity(device_id, action, description, lat=None, lng=None):
+    """Queue an activity log row, or write it inline when no worker runs"""
+    payload = {
+        'device_id': device_id,
+        'action': action,
+        'description': description,
+        'lat': lat,
+        'lng': lng,
+    }
+    if _worker_started:
+        _log_queue.put(payload)
+    else:
+        from models import db, ActivityLog
+        db.session.execute(ActivityLog.__table__.insert(), [payload])
@@ -0,0 +1,22 @@
+from contextlib import contextmanager
+
+@contextmanager
+def no_expire_on_commit(session):
+    """
+    Temporarily disable expire_on_commit for the wrapped block.
+
+    By default SQLAlchemy expires every loaded attribute when the session
+    commits, so reading the object afterwards (e.g. to_dict() for the
+    response) re-SELECTs the full row. Handlers that only serialize values
+    written in the same request can skip that reload safely.
+    """
+    # Flask-SQLAlchemy hands out a scoped_session proxy, which does not
+    # forward expire_on_commit - unwrap to the real Session first
+    if callable(session):
+        session = session()
+    prev = session.expire_on_commit
+    session.expire_on_commit = False
+    try:
+        yield
+    finally:
+        session.expire_on_commit = prev
@@ -1,5 +1,7 @@
 import smtplib
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime
@@ -10,9 +12,57 @@ SMTP_USER = os.getenv('SMTP_USER', '')
 SMTP_PASSWORD = os.getenv('SMTP_PASSWORD', '')
 FRONTEND_BASE_URL = os.getenv('FRONTEND_BASE_URL', 'http://localhost:3000')
 
-def send_alert_email(recipient, subject, body, html_body=None):
+def _fmt_now(fmt='%d-%b-%Y %H:%M'):
+    """Shared timestamp formatting for email bodies"""
+    return datetime.now().strftime(fmt)
+
+# Shared pool for sending alerts off the request path - an SMTP handshake
+# takes hundreds of milliseconds and must not block HTTP responses
+email_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='email-alert')
+
+# One SMTP connection per executor thread, reused across sends - the
+# TCP + STARTTLS + AUTH handshake dominates the cost of a single message
+_smtp_local = threading.local()
+
+def _drop_smtp_connection():
+    server = getattr(_smtp_local, 'server', None)
+    _smtp_local.server = None
+    if server is not None:
+        try:
+            server.close()
+        except Exception:
+            pass
+
+def _get_smtp_connection():
+    """Return this thread's live SMTP connection, reconnecting if stale.
+
+    A NOOP probe catches server-side idle disconnects; anything else
+    about the old connection is discarded and a fresh handshake is run.
     """
-    Send alert email using SMTP
+    server = getattr(_smtp_local, 'server', None)
+    if server is not None:
+        try:
+            if server.noop()[0] == 250:
+                return server
+        except Exception:
+            pass
+        _drop_smtp_connection()
+    server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
+    server.starttls()
+    server.login(SMTP_USER, SMTP_PASSWORD)
+    _smtp_local.server = server
+    return server
+
+def log_email_result(future):
+    """Done-callback for background sends - surfaces errors that would
+    otherwise vanish inside the executor"""
+    exc = future.exception()
+    if exc:
+        print(f"[EMAIL] Background send failed: {exc}")
+
+def _send_alert_email_sync(recipient, subject, body, html_body=None):
+    """
+    Send alert email using SMTP (blocking - runs on an executor thread)
     
     Args:
         recipient: Email address of recipient
@@ -40,20 +90,35 @@ def send_alert_email(recipient, subject, body, html_body=None):
             html_part = MIMEText(html_body, 'html')
             msg.attach(html_part)
         
-        # Send email
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(SMTP_USER, SMTP_PASSWORD)
-        server.send_message(msg)
-        server.quit()
+        # Send over the pooled connection; one retry covers a connection
+        # that went stale between the NOOP probe and the send
+        server = _get_smtp_connection()
+        try:
+            server.send_message(msg)
+        except smtplib.SMTPException:
+            _drop_smtp_connection()
+            server = _get_smtp_connection()
+            server.send_message(msg)
         
         print(f"[EMAIL] Alert sent to {recipient}: {subject}")
         return True
         
     except Exception as e:
+        _drop_smtp_connection()
         print(f"[EMAIL] Error sending email: {e}")
         return False
 
+def send_alert_email(recipient, subject, body, html_body=None):
+    """
+    Queue an alert email on the shared executor and return the Future.
+
+    Callers stay off the SMTP critical path; the done-callback logs any
+    failure, and .result() is available when a caller does need to wait.
+    """
+    future = email_executor.submit(_send_alert_email_sync, recipient, subject, body, html_body)
+    future.add_done_callback(log_email_result)
+    return future
+
 def send_device_alert(recipient, device_name, action, location=None):
     """Send device alert email"""
     subject = f"⚠️ Alert: Action Triggered on Your Device - {device_name}"
@@ -61,7 +126,7 @@ def send_device_alert(recipient, device_name, action, location=None):
     body = f"""Your device "{device_name}" has had the following action triggered:
     
 Action: {action.upper()}
-Time: {datetime.now().strftime('%d-%b-%Y %H:%M')}
+Time: {_fmt_now()}
 """
     
     if location:
@@ -100,7 +165,7 @@ WiFi Signal Strength: {signal_strength}% (Threshold: {signal_threshold}%)"""
         
         body += f"""
 Current Location: {location.get('lat')}, {location.get('lng')}
-Time: {datetime.now().strftime('%d-%b-%Y %H:%M:%S')}
+Time: {_fmt_now('%d-%b-%Y %H:%M:%S')}
 
 ⚠️ ACTION REQUIRED:
 1. Check if you moved the device yourself
@@ -117,7 +182,7 @@ If this was not you, please secure your account immediately!
         body = f"""Your device "{device_name}" has left the designated safe zone.
 
 Current Location: {location.get('lat')}, {location.get('lng')}
-Time: {datetime.now().strftime('%d-%b-%Y %H:%M')}
+Time: {_fmt_now()}
 
 Please verify this is expected activity.
 """
@@ -130,7 +195,7 @@ def send_missing_device_alert(recipient, device_name):
     
     body = f"""Your device "{device_name}" has been marked as missing.
 
-Time: {datetime.now().strftime('%d-%b-%Y %H:%M')}
+Time: {_fmt_now()}
 
 The device will attempt to capture screenshots and report its location.
 Please take immediate action if this device was stolen.
@@ -154,7 +219,7 @@ We detected {breach_count} breach(es) associated with your account:
     if len(breaches) > 5:
         body += f"\n... and {len(breaches) - 5} more breach(es)\n"
     
-    body += f"\nDate: {datetime.now().strftime('%d-%b-%Y %H:%M')}\n"
+    body += f"\nDate: {_fmt_now()}\n"
     body += "\nPlease change your passwords and enable two-factor authentication."
     
     return send_alert_email(recipient, subject, body)
@@ -165,7 +230,7 @@ def send_weekly_summary(recipient, stats):
     
     body = f"""Weekly Security Summary
 
-Date: {datetime.now().strftime('%d-%b-%Y')}
+Date: {_fmt_now('%d-%b-%Y')}
 
 Statistics:
 - Total Devices: {stats.get('total_devices', 0)}
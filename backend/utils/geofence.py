@@ -36,10 +36,23 @@ def check_geofence(lat, lng, geofence_config):
     center_lat = geofence_config['center_lat']
     center_lng = geofence_config['center_lng']
     radius_km = geofence_config.get('radius_km', 5.0)
-    
+
+    # Equirectangular fast path: for small separations the flat-earth
+    # distance is within ~0.5% of the geodesic, so when the point is more
+    # than 1 km away from the boundary the verdict cannot flip and the
+    # sqrt/atan2 of the full Haversine is skipped
+    dlat = lat - center_lat
+    # Wrap the longitude difference into [-180, 180) so points and fences
+    # straddling the antimeridian don't see a bogus ~360 degree separation
+    dlng = ((lng - center_lng + 180.0) % 360.0 - 180.0) * math.cos(math.radians(center_lat))
+    approx_km = 111.32 * math.sqrt(dlat * dlat + dlng * dlng)
+    if abs(approx_km - radius_km) > 1.0:
+        return approx_km <= radius_km, approx_km
+
+    # Near the boundary: settle it with the exact formula
     distance = calculate_distance(lat, lng, center_lat, center_lng)
     is_inside = distance <= radius_km
-    
+
     return is_inside, distance
 
 def is_geofence_breach(lat, lng, geofence_config, previous_inside=None):
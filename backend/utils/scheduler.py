@@ -132,11 +132,14 @@ def init_scheduler(app):
                     is_enabled=True
                 ).all()
                 
+                # One batched fetch instead of a per-rule Query.get round-trip
+                device_ids = [r.device_id for r in rules if r.device_id]
+                devices = {
+                    d.id: d for d in Device.query.filter(Device.id.in_(device_ids)).all()
+                } if device_ids else {}
+
                 for rule in rules:
-                    if not rule.device_id:
-                        continue
-                    
-                    device = Device.query.get(rule.device_id)
+                    device = devices.get(rule.device_id)
                     if not device or not device.last_lat or not device.last_lng:
                         continue
                     
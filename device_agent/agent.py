@@ -65,6 +65,10 @@ CONFIG_FILE = Path(__file__).parent / 'config.json'
 LOG_FILE = Path(__file__).parent / 'agent.log'
 API_BASE_URL = os.getenv('API_BASE_URL', 'http://localhost:5000/api')
 
+# Wipe/browse polls don't need the sub-second cadence of command checks;
+# 5s is still snappy for a manual wipe while cutting server load ~25x
+WIPE_BROWSE_POLL_INTERVAL = 5
+
 # Custom logging handler that handles Unicode encoding errors gracefully
 class SafeStreamHandler(logging.StreamHandler):
     """Stream handler that safely handles Unicode encoding errors"""
@@ -107,6 +111,11 @@ class DeviceAgent:
         self.alarm_thread = None   # Background alarm thread
         self.local_server = None  # Local HTTP server for browser discovery
         self.local_server_thread = None
+        self._last_wipe_browse_poll = 0.0  # Throttle for wipe/browse polls
+        self._agent_poll_etag = None   # Last ETag from the combined agent poll
+        self._combined_poll_supported = True  # Cleared if the server lacks the route
+        self._wipe_poll_etag = None    # Last ETag from the pending-wipe poll
+        self._browse_poll_etag = None  # Last ETag from the browse-request poll
         
         # Prey Project-style Agent-First automatic registration on startup
         # Device registers itself BEFORE any user account exists
@@ -1866,57 +1875,118 @@ class DeviceAgent:
                         self.last_lock_status = None
                         self.status = 'active'  # Ensure local status matches
                 
-                # Check for pending wipe operations (separate from status-based commands)
-                try:
-                    wipe_response = requests.get(
-                        f"{API_BASE_URL}/v1/wipe/pending/{self.device_id}",
-                        timeout=5
-                    )
-                    if wipe_response.status_code == 200:
-                        wipe_data = wipe_response.json()
-                        if wipe_data.get('has_pending'):
-                            operation_id = wipe_data.get('operation_id')
-                            # Support both 'paths' and 'folders' keys for compatibility
-                            paths = wipe_data.get('paths', wipe_data.get('folders', []))
-                            wipe_status = wipe_data.get('status', 'pending')
-                            
-                            if wipe_status == 'pending':
-                                logging.warning(f"🗑️ Pending wipe operation detected: {len(paths)} item(s)")
-                                # Execute wipe in background thread to avoid blocking
-                                wipe_thread = threading.Thread(
-                                    target=self.execute_wipe,
-                                    args=(paths, operation_id),
-                                    daemon=True
-                                )
-                                wipe_thread.start()
-                except Exception as e:
-                    logging.debug(f"Error checking for pending wipe: {e}")
-                
-                # Check for pending file browse requests
-                try:
-                    browse_response = requests.get(
-                        f"{API_BASE_URL}/v1/wipe/browse_request/{self.device_id}",
-                        timeout=5
-                    )
-                    if browse_response.status_code == 200:
-                        browse_data = browse_response.json()
-                        if browse_data.get('has_request'):
-                            browse_path = browse_data.get('path')
-                            request_id = browse_data.get('request_id')
-                            
-                            # List files in background thread
-                            browse_thread = threading.Thread(
-                                target=self._handle_browse_request,
-                                args=(browse_path, request_id),
-                                daemon=True
-                            )
-                            browse_thread.start()
-                except Exception as e:
-                    logging.debug(f"Error checking for browse requests: {e}")
+                # Check for pending wipe operations and file browse requests
+                # (separate from status-based commands)
+                self._poll_wipe_and_browse()
                     
         except Exception as e:
             logging.error(f"Error checking for commands: {e}")
     
+    def _poll_wipe_and_browse(self):
+        """Poll wipe and browse state in one combined conditional GET.
+        
+        Runs at most every WIPE_BROWSE_POLL_INTERVAL seconds rather than on
+        every command check, and replays the last ETag via If-None-Match so
+        an unchanged poll is a bodyless 304 the server answers without
+        touching the database. Servers that predate /v1/agent/poll get the
+        two separate legacy polls instead.
+        """
+        now = time.time()
+        if now - self._last_wipe_browse_poll < WIPE_BROWSE_POLL_INTERVAL:
+            return
+        self._last_wipe_browse_poll = now
+        
+        if self._combined_poll_supported:
+            try:
+                headers = {'If-None-Match': self._agent_poll_etag} if self._agent_poll_etag else {}
+                response = requests.get(
+                    f"{API_BASE_URL}/v1/agent/poll/{self.device_id}",
+                    headers=headers,
+                    timeout=5
+                )
+                if response.status_code == 304:
+                    return  # Nothing changed since the last poll
+                if response.status_code == 200:
+                    self._agent_poll_etag = response.headers.get('ETag')
+                    data = response.json()
+                    self._dispatch_pending_wipe(data.get('pending_wipe') or {})
+                    self._dispatch_browse_request(data.get('browse_request') or {})
+                    return
+                if response.status_code == 404:
+                    # 'Device not found' comes back as JSON; a bare route
+                    # miss means the server is older than the combined
+                    # endpoint, so fall back to the legacy polls for good
+                    try:
+                        if response.json().get('error') == 'Device not found':
+                            return
+                    except ValueError:
+                        pass
+                    logging.info("Combined agent poll unavailable, using legacy wipe/browse polls")
+                    self._combined_poll_supported = False
+            except Exception as e:
+                logging.debug(f"Error on combined agent poll: {e}")
+                return
+        
+        # Check for pending wipe operations
+        try:
+            headers = {'If-None-Match': self._wipe_poll_etag} if self._wipe_poll_etag else {}
+            wipe_response = requests.get(
+                f"{API_BASE_URL}/v1/wipe/pending/{self.device_id}",
+                headers=headers,
+                timeout=5
+            )
+            if wipe_response.status_code == 200:
+                self._wipe_poll_etag = wipe_response.headers.get('ETag')
+                self._dispatch_pending_wipe(wipe_response.json())
+        except Exception as e:
+            logging.debug(f"Error checking for pending wipe: {e}")
+        
+        # Check for pending file browse requests
+        try:
+            headers = {'If-None-Match': self._browse_poll_etag} if self._browse_poll_etag else {}
+            browse_response = requests.get(
+                f"{API_BASE_URL}/v1/wipe/browse_request/{self.device_id}",
+                headers=headers,
+                timeout=5
+            )
+            if browse_response.status_code == 200:
+                self._browse_poll_etag = browse_response.headers.get('ETag')
+                self._dispatch_browse_request(browse_response.json())
+        except Exception as e:
+            logging.debug(f"Error checking for browse requests: {e}")
+    
+    def _dispatch_pending_wipe(self, wipe_data):
+        """Kick off a background wipe if the server reports one pending"""
+        if wipe_data.get('has_pending'):
+            operation_id = wipe_data.get('operation_id')
+            # Support both 'paths' and 'folders' keys for compatibility
+            paths = wipe_data.get('paths', wipe_data.get('folders', []))
+            wipe_status = wipe_data.get('status', 'pending')
+            
+            if wipe_status == 'pending':
+                logging.warning(f"🗑️ Pending wipe operation detected: {len(paths)} item(s)")
+                # Execute wipe in background thread to avoid blocking
+                wipe_thread = threading.Thread(
+                    target=self.execute_wipe,
+                    args=(paths, operation_id),
+                    daemon=True
+                )
+                wipe_thread.start()
+    
+    def _dispatch_browse_request(self, browse_data):
+        """Answer a pending file-browse request in the background"""
+        if browse_data.get('has_request'):
+            browse_path = browse_data.get('path')
+            request_id = browse_data.get('request_id')
+            
+            # List files in background thread
+            browse_thread = threading.Thread(
+                target=self._handle_browse_request,
+                args=(browse_path, request_id),
+                daemon=True
+            )
+            browse_thread.start()
+    
     def execute_command(self, command, **kwargs):
         """Execute remote command locally"""
         logging.warning(f"⚠️ REMOTE COMMAND RECEIVED: {command.upper()}")